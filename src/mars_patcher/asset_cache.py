@@ -0,0 +1,102 @@
+from bisect import bisect_left, insort
+
+from mars_patcher.range_set import RangeSet
+
+
+class AssetCache:
+    """
+    Caches decompressed assets, such as room layers and minimaps, keyed by the compression
+    format and the address of the compressed data, so loading an asset again doesn't
+    decompress it again. An entry is no longer used once any of its compressed data is written
+    to.
+
+    Entries for data that hasn't changed since the cache was created are shared with forks of
+    the cache, so forked ROMs (such as one for each seed in a batch) reuse the assets that
+    any of them decompressed.
+
+    Attributes:
+        hits: The number of assets that were found in the cache.
+        misses: The number of assets that were not found in the cache.
+    """
+
+    def __init__(self) -> None:
+        # Entries for data as it was when the cache was created, shared with forks
+        self._shared: dict[tuple[str, int], tuple[bytes, int]] = {}
+        # Entries for data that was written to since then, keyed by address and then kind
+        self._local: dict[int, dict[str, tuple[bytes, int]]] = {}
+        # The sorted addresses of the local entries, and the largest compressed size of any of
+        # them, so writes only check the entries that could overlap them
+        self._local_addrs: list[int] = []
+        self._max_local_size = 0
+        # Ranges written to since the cache was created
+        self._written = RangeSet()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, kind: str, addr: int) -> tuple[bytearray, int] | None:
+        """
+        Returns a copy of the decompressed data for the compressed data at an address, along
+        with the size of the compressed data, or None if it's not cached.
+        """
+        local = self._local.get(addr)
+        entry = local.get(kind) if local is not None else None
+        if entry is None:
+            entry = self._shared.get((kind, addr))
+            if entry is not None and self._written.overlaps(addr, addr + entry[1]):
+                entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return bytearray(entry[0]), entry[1]
+
+    def put(self, kind: str, addr: int, data: bytes | bytearray, comp_size: int) -> None:
+        """Caches the decompressed data for the compressed data at an address."""
+        entry = (bytes(data), comp_size)
+        if self._written.overlaps(addr, addr + comp_size):
+            local = self._local.get(addr)
+            if local is None:
+                local = self._local[addr] = {}
+                insort(self._local_addrs, addr)
+            local[kind] = entry
+            self._max_local_size = max(self._max_local_size, comp_size)
+        else:
+            self._shared[(kind, addr)] = entry
+
+    def invalidate(self, addr: int, size: int) -> None:
+        """Records a write, so entries for compressed data that it overlaps are not used."""
+        end = addr + size
+        self._written.add(addr, end)
+        if not self._local:
+            return
+        addrs = self._local_addrs
+        # Entries starting before this can't reach the write
+        i = bisect_left(addrs, addr - self._max_local_size + 1)
+        j = bisect_left(addrs, end)
+        for entry_addr in addrs[i:j]:
+            local = self._local[entry_addr]
+            for kind, (_, comp_size) in list(local.items()):
+                if addr < entry_addr + comp_size:
+                    del local[kind]
+            if not local:
+                del self._local[entry_addr]
+        addrs[i:j] = [a for a in addrs[i:j] if a in self._local]
+
+    def clear(self) -> None:
+        """Removes all entries, such as when the data is replaced."""
+        # Forks still use the old shared entries, so they're replaced instead of cleared
+        self._shared = {}
+        self._local = {}
+        self._local_addrs = []
+        self._max_local_size = 0
+        self._written = RangeSet()
+
+    def fork(self) -> "AssetCache":
+        """Returns a cache for a forked ROM, which shares entries for unchanged data."""
+        other = AssetCache()
+        other._shared = self._shared
+        other._local = {addr: local.copy() for addr, local in self._local.items()}
+        other._local_addrs = self._local_addrs.copy()
+        other._max_local_size = self._max_local_size
+        other._written = self._written.copy()
+        return other
@@ -2,6 +2,7 @@ import argparse
 import json
 
 from mars_patcher.patcher import patch
+from mars_patcher.rom import OutputFormat
 
 
 def main() -> None:
@@ -9,7 +10,44 @@ def main() -> None:
     parser.add_argument("rom_path", type=str, help="Path to a GBA ROM file")
     parser.add_argument("out_path", type=str, help="Path to output ROM file")
     parser.add_argument("patch_data_path", type=str, help="Path to patch data json file")
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        default=None,
+        help="Directory for caching the base patched ROM and compressed data between runs",
+    )
+    parser.add_argument(
+        "--output-format",
+        type=str,
+        choices=[f.name.lower() for f in OutputFormat],
+        default=OutputFormat.ROM.name.lower(),
+        help="Whether to output the full ROM or a patch against the input ROM",
+    )
+    parser.add_argument(
+        "--deduplicate-data",
+        action="store_true",
+        help="Share a single copy of identical data written to free space",
+    )
+    parser.add_argument(
+        "--discover-free-space",
+        action="store_true",
+        help="Use unused padding in the ROM as additional free space",
+    )
+    parser.add_argument(
+        "--expand-rom",
+        type=int,
+        choices=[16, 32],
+        default=None,
+        help="Expand the ROM to this many MB to fit more data",
+    )
+    parser.add_argument(
+        "--compact-free-space",
+        action="store_true",
+        help="Pack data written to free space together at the end of patching",
+    )
     args = parser.parse_args()
+    if args.output_format == OutputFormat.IPS.name.lower() and args.expand_rom is not None:
+        parser.error("--expand-rom can't be used with IPS output")
 
     # Load patch data file
     with open(args.patch_data_path, encoding="utf-8") as f:
@@ -20,4 +58,10 @@ def main() -> None:
         args.out_path,
         patch_data,
         lambda message, progress: print(message),
+        args.cache_dir,
+        OutputFormat[args.output_format.upper()],
+        args.deduplicate_data,
+        args.discover_free_space,
+        args.expand_rom * 0x100000 if args.expand_rom is not None else None,
+        args.compact_free_space,
     )
@@ -2,9 +2,12 @@ from typing import Annotated, TypeAlias
 
 import mars_patcher.mf.auto_generated_types as types_mf
 import mars_patcher.zm.auto_generated_types as types_zm
+from mars_patcher.cow_buffer import CowBuffer
 
 BytesLike: TypeAlias = bytes | bytearray
 
+RomData: TypeAlias = bytearray | CowBuffer
+
 TypeU8: TypeAlias = types_mf.TypeU8 | types_zm.TypeU8
 
 AreaId: TypeAlias = types_mf.AreaId | types_zm.AreaId
@@ -1,12 +1,40 @@
-from mars_patcher.common_types import BytesLike
+from collections.abc import Callable, Iterable, Iterator
+from itertools import groupby
+
+from mars_patcher.common_types import BytesLike, RomData
+from mars_patcher.compression_cache import CompressionCache
 
 MIN_MATCH_SIZE = 3
 MIN_WINDOW_SIZE = 1
 MAX_MATCH_SIZE = (1 << 4) - 1 + MIN_MATCH_SIZE
 MAX_WINDOW_SIZE = (1 << 12) - 1 + MIN_WINDOW_SIZE
 
+_FLAG_MASKS = (0x80, 0x40, 0x20, 0x10, 0x08, 0x04, 0x02, 0x01)
+"""The bit of an LZ77 compression flag for each of the 8 bytes or matches after it."""
+
+RLE_VERSION = 1
+"""The version of the RLE compressor, which changes whenever its output changes, so output
+cached from older versions is not used."""
+LZ77_VERSION = 1
+"""The version of the LZ77 compressor, which changes whenever its output changes, so output
+cached from older versions is not used."""
+
+
+def _cached(
+    cache: CompressionCache | None, kind: str, input: BytesLike, compress: Callable[[], bytearray]
+) -> bytearray:
+    """Returns the cached output for the input if there is any, otherwise compresses it."""
+    if cache is None:
+        return compress()
+    key = cache.key(kind, input)
+    output = cache.get(key)
+    if output is None:
+        output = compress()
+        cache.put(key, output)
+    return output
+
 
-def decomp_rle(input: BytesLike, idx: int) -> tuple[bytearray, int]:
+def decomp_rle(input: BytesLike | RomData | memoryview, idx: int) -> tuple[bytearray, int]:
     """
     Decompresses RLE data and returns it with the size of the compressed data.
     """
@@ -37,17 +65,15 @@ def decomp_rle(input: BytesLike, idx: int) -> tuple[bytearray, int]:
             if (amount & compare) != 0:
                 # Compressed
                 amount %= compare
-                val = input[idx]
+                passes += bytes((input[idx],)) * amount
                 idx += 1
-                while amount > 0:
-                    passes.append(val)
-                    amount -= 1
             else:
                 # Uncompressed
-                while amount > 0:
-                    passes.append(input[idx])
-                    idx += 1
-                    amount -= 1
+                end = idx + amount
+                if end > len(input):
+                    raise IndexError("Uncompressed bytes past the end of the data")
+                passes += input[idx:end]
+                idx = end
 
     # Each pass must be equal length
     if half is None:
@@ -57,251 +83,452 @@ def decomp_rle(input: BytesLike, idx: int) -> tuple[bytearray, int]:
 
     # Combine passes to get output
     output = bytearray(len(passes))
-    for i in range(half):
-        output[i * 2] = passes[i]
-        output[i * 2 + 1] = passes[half + i]
+    output[0::2] = passes[:half]
+    output[1::2] = passes[half:]
 
     # Return bytes and compressed size
     comp_size = idx - src_start
     return output, comp_size
 
 
-def comp_rle(input: BytesLike) -> bytearray:
+def comp_rle(input: BytesLike, cache: CompressionCache | None = None) -> bytearray:
     """
-    Compresses data using RLE.
+    Compresses data using RLE. If a compression cache is provided, it's used for data that was
+    compressed before.
     """
+    return _cached(cache, f"rle-{RLE_VERSION}", input, lambda: _comp_rle(input))
 
-    # Inner helper functions
-    def write_len(arr: bytearray, val: int, size: int) -> None:
-        if size == 0:
-            arr.append(val)
-        else:
-            arr.append(val >> 8)
-            arr.append(val & 0xFF)
-
-    def add_unique(arr: bytearray, unique: bytearray, size: int) -> None:
-        write_len(arr, len(unique), size)
-        arr += unique
-        unique.clear()
 
+def _comp_rle(input: BytesLike) -> bytearray:
     output = bytearray()
     # Do two passes for low and high bytes
     for p in range(2):
+        data = bytes(input[p::2])
         # Get counts of consecutive values
-        values = bytearray()
-        counts = []
+        counts = [len(list(group)) for _, group in groupby(data)]
+        # Use the read length (1 or 2) that gives the shortest output
+        r = 1 if _rle_size(counts, 1) < _rle_size(counts, 0) else 0
+        output += _write_rle(data, counts, r)
+    return output
 
-        prev = input[p]
-        values.append(prev)
-        count = 1
 
-        for i in range(p + 2, len(input), 2):
-            val = input[i]
-            if val == prev:
-                count += 1
-            else:
-                values.append(val)
-                counts.append(count)
-                prev = val
-                count = 1
-        counts.append(count)
-
-        # Try each read length (1 or 2)
-        shortest: bytearray | None = None
-        for r in range(2):
-            temp = bytearray()
-            min_run_len = 3 + r
-            flag = 0x80 << (8 * r)
-            max_run_len = flag - 1
-            unique = bytearray()
-
-            # Write number of bytes to read
-            temp.append(r + 1)
-
-            # For each value and its count
-            for i in range(len(values)):
-                count = counts[i]
-                # If the value's count is long enough for a run
-                if count >= min_run_len:
-                    # If the value is preceded by unique values
-                    if len(unique) > 0:
-                        add_unique(temp, unique, r)
-                    # Add run length and value (multiple times if over max run length)
-                    while count > 0:
-                        curr_len = min(count, max_run_len)
-                        len_flag = curr_len + flag
-                        write_len(temp, len_flag, r)
-                        temp.append(values[i])
-                        count -= curr_len
-                # If the value's count is too short for a run
-                else:
-                    # If the total count would be too long for a run
-                    if len(unique) + count > max_run_len:
-                        add_unique(temp, unique, r)
-                    for _ in range(count):
-                        unique.append(values[i])
-            # Check if there were unique values at the end
-            if len(unique) > 0:
-                add_unique(temp, unique, r)
-            # Write ending zero(s)
-            temp.append(0)
-            if r == 1:
-                temp.append(0)
-            if shortest is None or len(temp) < len(shortest):
-                shortest = temp
-        if shortest is None:
-            raise ValueError("shortest was not assigned")
-        output += shortest
+def _rle_size(counts: list[int], r: int) -> int:
+    """Returns the size of one RLE pass with the provided read length (0 for 1, 1 for 2)."""
+    len_size = r + 1
+    min_run_len = 3 + r
+    max_run_len = (0x80 << (8 * r)) - 1
+    # Number of bytes to read, and ending zero(s)
+    size = 1 + len_size
+    unique_len = 0
+    for count in counts:
+        if count >= min_run_len:
+            if unique_len > 0:
+                size += len_size + unique_len
+                unique_len = 0
+            runs = (count + max_run_len - 1) // max_run_len
+            size += runs * (len_size + 1)
+        else:
+            if unique_len + count > max_run_len:
+                size += len_size + unique_len
+                unique_len = 0
+            unique_len += count
+    if unique_len > 0:
+        size += len_size + unique_len
+    return size
+
+
+def _write_rle(data: bytes, counts: list[int], r: int) -> bytearray:
+    """Writes one RLE pass with the provided read length (0 for 1, 1 for 2)."""
+
+    def write_len(arr: bytearray, val: int) -> None:
+        if r == 0:
+            arr.append(val)
+        else:
+            arr.append(val >> 8)
+            arr.append(val & 0xFF)
+
+    output = bytearray()
+    min_run_len = 3 + r
+    flag = 0x80 << (8 * r)
+    max_run_len = flag - 1
+
+    # Write number of bytes to read
+    output.append(r + 1)
+
+    # Values that are not part of a run are always consecutive, so they're copied as a slice
+    # ending at the current position
+    pos = 0
+    unique_len = 0
+    for count in counts:
+        # If the value's count is long enough for a run
+        if count >= min_run_len:
+            # If the value is preceded by unique values
+            if unique_len > 0:
+                write_len(output, unique_len)
+                output += data[pos - unique_len : pos]
+                unique_len = 0
+            # Add run length and value (multiple times if over max run length)
+            val = data[pos]
+            remain = count
+            while remain > 0:
+                curr_len = min(remain, max_run_len)
+                write_len(output, curr_len + flag)
+                output.append(val)
+                remain -= curr_len
+        # If the value's count is too short for a run
+        else:
+            # If the total count would be too long for a run
+            if unique_len + count > max_run_len:
+                write_len(output, unique_len)
+                output += data[pos - unique_len : pos]
+                unique_len = 0
+            unique_len += count
+        pos += count
+    # Check if there were unique values at the end
+    if unique_len > 0:
+        write_len(output, unique_len)
+        output += data[pos - unique_len : pos]
+    # Write ending zero(s)
+    write_len(output, 0)
     return output
 
 
-def decomp_lz77(input: BytesLike, idx: int) -> tuple[bytearray, int]:
+def decomp_lz77(input: BytesLike | RomData | memoryview, idx: int) -> tuple[bytearray, int]:
     """Decompresses LZ77 data and returns it with the size of the compressed data."""
     # Check for 0x10 flag
     if input[idx] != 0x10:
         raise ValueError("Missing 0x10 flag")
 
     # Get length of decompressed data
-    remain = input[idx + 1] | (input[idx + 2] << 8) | (input[idx + 3] << 16)
-    output = bytearray([0] * remain)
+    size = input[idx + 1] | (input[idx + 2] << 8) | (input[idx + 3] << 16)
 
     # Check for valid data size
-    if remain == 0:
+    if size == 0:
         raise ValueError("Invalid data size")
 
-    start = idx
-    idx += 4
-    dst = 0
+    # Copy the most data that could be compressed: each flag is followed by up to 8 bytes or
+    # matches, and each byte or match outputs at least one byte for each byte it uses
+    src = input[idx + 4 : idx + 4 + size + (size + 7) // 8]
+    idx = 0
+    output = bytearray()
+    append = output.append
 
     # Decompress
     while True:
-        cflag = input[idx]
+        cflag = src[idx]
         idx += 1
 
-        for _ in range(8):
-            if (cflag & 0x80) == 0:
+        for mask in _FLAG_MASKS:
+            if (cflag & mask) == 0:
                 # Uncompressed
-                output[dst] = input[idx]
+                append(src[idx])
                 idx += 1
-                dst += 1
-                remain -= 1
             else:
                 # Compressed
-                amount_to_copy = (input[idx] >> 4) + MIN_MATCH_SIZE
-                window = ((input[idx] & 0xF) << 8) + input[idx + 1] + MIN_WINDOW_SIZE
+                amount_to_copy = (src[idx] >> 4) + MIN_MATCH_SIZE
+                window = ((src[idx] & 0xF) << 8) + src[idx + 1] + MIN_WINDOW_SIZE
                 idx += 2
-                remain -= amount_to_copy
-
-                for _ in range(amount_to_copy):
-                    output[dst] = output[dst - window]
-                    dst += 1
+                copy_start = len(output) - window
+                if copy_start < 0:
+                    raise ValueError("Match starts before the start of the data")
+                if window >= amount_to_copy:
+                    output += output[copy_start : copy_start + amount_to_copy]
+                else:
+                    # The match overlaps the bytes it produces, which repeats the pattern
+                    # between the match position and the output position
+                    pattern = output[copy_start:]
+                    output += (pattern * (amount_to_copy // window + 1))[:amount_to_copy]
 
-            if remain <= 0:
-                if remain < 0:
+            if len(output) >= size:
+                if len(output) > size:
                     raise ValueError("Too many bytes copied at end")
-                comp_size = idx - start
+                comp_size = idx + 4
                 return output, comp_size
-            cflag <<= 1
 
 
-def comp_lz77(input: BytesLike) -> bytearray:
-    """Compresses data using LZ77."""
-    length = len(input)
+def comp_lz77(
+    input: BytesLike,
+    optimal: bool = False,
+    max_checks_in_window: int = 64,
+    lazy: bool = False,
+    cache: CompressionCache | None = None,
+) -> bytearray:
+    """
+    Compresses data using LZ77. If a compression cache is provided, it's used for data that was
+    compressed before with the same settings.
+
+    Args:
+        input: The data to compress.
+        optimal: Whether to choose the matches that give the smallest output, using dynamic
+            programming over the longest match at every position in the full window. This is
+            slower, but the output is never larger than the default, which always uses the
+            longest match at the current position.
+        max_checks_in_window: How many earlier positions are checked when looking for the
+            longest match at a position. Checking more improves compression size at the
+            expense of speed. Not used for optimal compression, which checks the full window.
+        lazy: Whether to write an uncompressed byte instead of a match when the next position
+            has a longer match. Not used for optimal compression.
+        cache: The cache of data compressed on earlier runs, if any.
+    """
+    if optimal:
+        kind = f"lz77-{LZ77_VERSION}-optimal"
+    else:
+        kind = f"lz77-{LZ77_VERSION}-{max_checks_in_window}-{int(lazy)}"
+    return _cached(
+        cache, kind, input, lambda: _comp_lz77(input, optimal, max_checks_in_window, lazy)
+    )
+
+
+def _comp_lz77(input: BytesLike, optimal: bool, max_checks_in_window: int, lazy: bool) -> bytearray:
+    data = bytes(input)
+    if optimal:
+        tokens: Iterable[tuple[int, int] | None] = _optimal_parse(data)
+    elif lazy:
+        tokens = _lazy_parse(data, max_checks_in_window)
+    else:
+        tokens = _greedy_parse(data, max_checks_in_window)
+    return _write_lz77(data, tokens)
+
+
+LZ77_FIT_ATTEMPTS = (
+    {"max_checks_in_window": 64},
+    {"max_checks_in_window": 512},
+    {"max_checks_in_window": 512, "lazy": True},
+    {"optimal": True},
+)
+"""The arguments to comp_lz77 tried by comp_lz77_to_fit, in order of increasing effort."""
+
+
+def comp_lz77_to_fit(
+    input: BytesLike, max_size: int, cache: CompressionCache | None = None
+) -> bytearray:
+    """
+    Compresses data using LZ77 with increasing effort until the output fits in a maximum size,
+    such as the size of the data it replaces. The first output that fits is returned; if none
+    fit, the smallest output is returned. If a compression cache is provided, it's used for
+    each attempt.
+    """
+    smallest: bytearray | None = None
+    for kwargs in LZ77_FIT_ATTEMPTS:
+        output = comp_lz77(input, **kwargs, cache=cache)
+        if len(output) <= max_size:
+            return output
+        if smallest is None or len(output) < len(smallest):
+            smallest = output
+    assert smallest is not None
+    return smallest
+
+
+def _greedy_parse(data: bytes, max_checks_in_window: int) -> Iterator[tuple[int, int] | None]:
+    """Yields the longest match at each position, or None for an uncompressed byte."""
+    finder = _MatchFinder(data, max_checks_in_window)
     idx = 0
-    longest_matches = _find_longest_matches(input, 64)
+    length = len(data)
+    while idx < length:
+        match = finder.longest_match(idx)
+        yield match
+        idx += 1 if match is None else match[1]
 
-    # Write start of data
-    output = bytearray()
-    output.append(0x10)
-    output.append(length & 0xFF)
-    output.append((length >> 8) & 0xFF)
-    output.append(length >> 16)
 
+def _lazy_parse(data: bytes, max_checks_in_window: int) -> Iterator[tuple[int, int] | None]:
+    """
+    Yields the longest match at each position, or None for an uncompressed byte. A match is
+    skipped in favor of an uncompressed byte when the next position has a longer match.
+    """
+    finder = _MatchFinder(data, max_checks_in_window)
+    idx = 0
+    length = len(data)
+    match = finder.longest_match(idx)
     while idx < length:
-        # Get index of new compression flag
-        flag = len(output)
-        output.append(0)
-
-        for i in range(8):
-            # Find longest match at current position
-            longest_match = longest_matches.get(idx)
-            if longest_match is not None:
-                # Compressed
-                match_idx, match_len = longest_match
-                match_offset = idx - match_idx - MIN_WINDOW_SIZE
-                output.append(((match_len - MIN_MATCH_SIZE) << 4) | (match_offset >> 8))
-                output.append(match_offset & 0xFF)
-                output[flag] |= 0x80 >> i
-                idx += match_len
-            else:
-                # Uncompressed
-                output.append(input[idx])
+        if match is None:
+            yield None
+            idx += 1
+        else:
+            next_match = finder.longest_match(idx + 1)
+            if next_match is not None and next_match[1] > match[1]:
+                yield None
                 idx += 1
-
-            # Check if at end
-            if idx >= length:
-                return output
-
-    raise RuntimeError("LZ77 compression error")
+                match = next_match
+                continue
+            yield match
+            idx += match[1]
+        match = finder.longest_match(idx)
 
 
-def _find_longest_matches(
-    input: BytesLike, max_checks_in_window: int = MAX_WINDOW_SIZE
-) -> dict[int, tuple[int, int]]:
-    length = len(input)
-    triplets: dict[int, list[int]] = {}
-    longest_matches: dict[int, tuple[int, int]] = {}
+def _optimal_parse(data: bytes) -> list[tuple[int, int] | None]:
+    """
+    Returns the matches that give the smallest output, or None for each uncompressed byte.
+    Every match costs the same regardless of its distance, so only the longest match at each
+    position and the shorter matches contained in it need to be considered.
+    """
+    length = len(data)
+    matches = [_longest_match_in_window(data, i) for i in range(length)]
+    # The size in bits of the data from each position to the end, including one flag bit
+    # for each byte or match, and the size of the first byte or match at that position
+    costs = [0] * (length + 1)
+    sizes = [1] * (length + 1)
+    for i in range(length - 1, -1, -1):
+        best_cost = costs[i + 1] + 9
+        best_size = 1
+        match = matches[i]
+        if match is not None:
+            for size in range(MIN_MATCH_SIZE, match[1] + 1):
+                cost = costs[i + size] + 17
+                if cost <= best_cost:
+                    best_cost = cost
+                    best_size = size
+        costs[i] = best_cost
+        sizes[i] = best_size
+
+    tokens: list[tuple[int, int] | None] = []
+    idx = 0
+    while idx < length:
+        size = sizes[idx]
+        match = matches[idx]
+        if size == 1 or match is None:
+            tokens.append(None)
+            idx += 1
+        else:
+            tokens.append((match[0], size))
+            idx += size
+    return tokens
 
-    for i in range(length - 2):
-        # Get triplet at current position
-        triplet = input[i] | (input[i + 1] << 8) | (input[i + 2] << 16)
 
-        # Check if triplet has no match
-        indexes = triplets.get(triplet)
-        if indexes is None:
-            triplets[triplet] = [i]
-            continue
+def _longest_match_in_window(data: bytes, idx: int) -> tuple[int, int] | None:
+    """
+    Returns the position and length of the closest of the longest matches for the data at a
+    position, checking the whole window. Each search for a longer match is a single rfind,
+    so the window is scanned in C.
+    """
+    length = len(data)
+    max_size = min(MAX_MATCH_SIZE, length - idx)
+    if max_size < MIN_MATCH_SIZE:
+        return None
+    window_start = max(idx - MAX_WINDOW_SIZE, 0)
+    # Matches one byte behind the position can't be decompressed to VRAM
+    last_start = idx - 2
+    longest_len = MIN_MATCH_SIZE - 1
+    longest_idx = -1
+    while longest_len < max_size:
+        size = longest_len + 1
+        found = data.rfind(data[idx : idx + size], window_start, last_start + size)
+        if found == -1:
+            break
+        # Extend the match as far as possible before searching for a longer one
+        while size < max_size and data[found + size] == data[idx + size]:
+            size += 1
+        longest_len = size
+        longest_idx = found
+    if longest_idx == -1:
+        return None
+    return longest_idx, longest_len
+
+
+def _write_lz77(data: bytes, tokens: Iterable[tuple[int, int] | None]) -> bytearray:
+    """Writes LZ77 data from matches, or None for each uncompressed byte."""
+    length = len(data)
+    idx = 0
 
-        window_start = max(i - MAX_WINDOW_SIZE, 0)
-        max_size = min(MAX_MATCH_SIZE, length - i)
-        longest_len = 0
-        longest_idx = -1
+    # Write start of data
+    output = bytearray()
+    output.append(0x10)
+    output.append(length & 0xFF)
+    output.append((length >> 8) & 0xFF)
+    output.append(length >> 16)
 
-        # Skip first index if one byte behind current position
-        j = len(indexes) - 1
-        if indexes[j] >= i - 1:
-            j -= 1
+    flag = 0
+    bit = 8
+    for token in tokens:
+        if bit == 8:
+            # Get index of new compression flag
+            flag = len(output)
+            output.append(0)
+            bit = 0
+        if token is not None:
+            # Compressed
+            match_idx, match_len = token
+            match_offset = idx - match_idx - MIN_WINDOW_SIZE
+            output.append(((match_len - MIN_MATCH_SIZE) << 4) | (match_offset >> 8))
+            output.append(match_offset & 0xFF)
+            output[flag] |= 0x80 >> bit
+            idx += match_len
+        else:
+            # Uncompressed
+            output.append(data[idx])
+            idx += 1
+        bit += 1
 
-        # Avoid checking too many matches (improves speed at the expense of compression size)
-        stop = max(j - max_checks_in_window, -1)
+    if idx != length:
+        raise RuntimeError("LZ77 compression error")
+    return output
 
-        # Try each index to find the longest match
-        for j in range(j, stop, -1):
-            idx = indexes[j]
-            # Stop if past window
-            if idx < window_start:
-                break
 
-            # Quick check if match would be longer
-            if longest_len > 0 and input[idx + longest_len] != input[i + longest_len]:
-                continue
+class _MatchFinder:
+    """
+    Finds the longest LZ77 match at a position using hash chains: the most recent position of
+    each 3 byte prefix, and for every position, the previous position with the same prefix.
+    Candidates are compared with bytes.startswith, so most comparisons happen in C.
 
-            # Find length of match
-            match_len = MIN_MATCH_SIZE
-            while match_len < max_size and input[idx + match_len] == input[i + match_len]:
-                match_len += 1
+    Positions are added to the chains as later positions are searched, so positions must be
+    searched in increasing order.
+    """
 
-            # Update longest match
-            if match_len > longest_len:
+    def __init__(self, data: bytes, max_checks_in_window: int = MAX_WINDOW_SIZE):
+        self.data = data
+        self.max_checks_in_window = max_checks_in_window
+        self._head: dict[bytes, int] = {}
+        self._prev = [-1] * len(data)
+        self._added = 0
+
+    def longest_match(self, idx: int) -> tuple[int, int] | None:
+        """
+        Returns the position and length of the longest match for the data at a position, or
+        None if there is no match. When several matches have the same length, the closest one
+        is returned. Matches one byte behind the position are never used, since the GBA BIOS
+        can't decompress them to VRAM. Checking fewer matches in the window improves speed at
+        the expense of compression size.
+        """
+        data = self.data
+        length = len(data)
+        if idx > length - MIN_MATCH_SIZE:
+            return None
+        head = self._head
+        prev = self._prev
+        # Add every position before this one to the chains
+        if self._added < idx:
+            for i in range(self._added, idx):
+                key = data[i : i + MIN_MATCH_SIZE]
+                prev[i] = head.get(key, -1)
+                head[key] = i
+            self._added = idx
+
+        candidate = head.get(data[idx : idx + MIN_MATCH_SIZE], -1)
+        if candidate == idx - 1:
+            candidate = prev[candidate]
+        window_start = idx - MAX_WINDOW_SIZE
+        if window_start < 0:
+            window_start = 0
+        max_size = min(MAX_MATCH_SIZE, length - idx)
+        longest_len = 0
+        longest_idx = -1
+        # A candidate is only used if it matches more bytes than the longest match so far
+        prefix = data[idx : idx + MIN_MATCH_SIZE]
+        checks = self.max_checks_in_window
+        startswith = data.startswith
+        while candidate >= window_start and checks > 0:
+            if startswith(prefix, candidate):
+                match_len = len(prefix)
+                while match_len < max_size and data[candidate + match_len] == data[idx + match_len]:
+                    match_len += 1
                 longest_len = match_len
-                longest_idx = idx
-
+                longest_idx = candidate
                 # Stop looking if max size
-                if longest_len == max_size:
+                if match_len == max_size:
                     break
+                prefix = data[idx : idx + match_len + 1]
+            candidate = prev[candidate]
+            checks -= 1
 
-        indexes.append(i)
-        if longest_len >= MIN_MATCH_SIZE:
-            longest_matches[i] = (longest_idx, longest_len)
-
-    return longest_matches
+        if longest_len == 0:
+            return None
+        return longest_idx, longest_len
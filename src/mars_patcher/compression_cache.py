@@ -0,0 +1,131 @@
+import hashlib
+import os
+import struct
+from os import PathLike
+
+from mars_patcher.common_types import BytesLike
+
+DEFAULT_MAX_SIZE = 32 * 1024 * 1024
+"""The default maximum total size of the cached entries."""
+
+ENTRY_SUFFIX = ".bin"
+
+_HEADER = struct.Struct("<I16s")
+"""The header of each entry: the size of the compressed data and a hash of it."""
+
+
+class CompressionCache:
+    """
+    An on-disk cache of compressed data, keyed by a hash of the uncompressed data along with
+    the compression format, settings, and compressor version. Each entry is a separate file.
+    When the entries take up more than the maximum size, the least recently used ones are
+    removed. Each entry starts with the size and a hash of its data, so truncated or corrupted
+    entries are not used. The cache is only an optimization, so failing to read or write it is
+    ignored.
+    """
+
+    def __init__(self, directory: str | PathLike[str], max_size: int = DEFAULT_MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        # The total size of the entries, which is found when the first entry is added
+        self._size: int | None = None
+
+    @staticmethod
+    def key(kind: str, data: BytesLike) -> str:
+        """
+        Returns the key for data compressed a certain way. The kind should change whenever the
+        compressed output would change.
+        """
+        h = hashlib.blake2b(digest_size=16)
+        h.update(kind.encode())
+        h.update(b"\0")
+        h.update(data)
+        return h.hexdigest()
+
+    @staticmethod
+    def _digest(data: BytesLike) -> bytes:
+        return hashlib.blake2b(data, digest_size=16).digest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ENTRY_SUFFIX)
+
+    def get(self, key: str) -> bytearray | None:
+        """
+        Returns the compressed data for a key, if it's cached and its size and hash match the
+        entry's header.
+        """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                entry = f.read()
+        except OSError:
+            return None
+        if len(entry) < _HEADER.size:
+            return None
+        size, digest = _HEADER.unpack_from(entry)
+        data = bytearray(entry[_HEADER.size :])
+        if len(data) != size or self._digest(data) != digest:
+            # Treated as a miss, and replaced when the data is compressed again
+            return None
+        try:
+            # Mark the entry as recently used
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def put(self, key: str, data: BytesLike) -> None:
+        """Caches the compressed data for a key, removing old entries if needed."""
+        path = self._path(key)
+        # Write to a temporary file first, so other processes never see a partial entry
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(temp_path, "wb") as f:
+                f.write(_HEADER.pack(len(data), self._digest(data)))
+                f.write(data)
+            os.replace(temp_path, path)
+        except OSError:
+            return
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self._entries())
+        else:
+            self._size += _HEADER.size + len(data)
+        if self._size > self.max_size:
+            self._evict()
+
+    def _entries(self) -> list[tuple[float, int, str]]:
+        """Returns the last use time, size, and path of every entry."""
+        entries = []
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        for name in names:
+            if not name.endswith(ENTRY_SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _evict(self) -> None:
+        """
+        Removes the least recently used entries until the entries take up at most 3/4 of the
+        maximum size, so entries aren't removed again every time one is added.
+        """
+        entries = sorted(self._entries())
+        size = sum(size for _, size, _ in entries)
+        target = self.max_size * 3 // 4
+        for _, entry_size, path in entries:
+            if size <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            size -= entry_size
+        self._size = size
@@ -1,3 +1,6 @@
+import sys
+from array import array
+
 from mars_patcher.common_types import BytesLike
 from mars_patcher.rom import ROM_OFFSET
 
@@ -5,16 +8,23 @@ from mars_patcher.rom import ROM_OFFSET
 def u8_to_u16(data: BytesLike | list[int]) -> list[int]:
     """Converts a bytes object or list of 8-bit integers to a list of 16-bit integers."""
     assert len(data) % 2 == 0, "Data length must be a multiple of 2"
-    return [data[i] | (data[i + 1] << 8) for i in range(0, len(data), 2)]
+    if isinstance(data, list):
+        data = bytes(data)
+    # Bytes objects are cast in place without copying
+    view = memoryview(data).cast("H")
+    if sys.byteorder == "little":
+        return view.tolist()
+    vals = array("H", view)
+    vals.byteswap()
+    return vals.tolist()
 
 
 def u16_to_u8(data: list[int]) -> bytes:
     """Converts a list of 16-bit integers to a bytes object of 8-bit integers."""
-    output = bytearray()
-    for val in data:
-        output.append(val & 0xFF)
-        output.append(val >> 8)
-    return bytes(output)
+    vals = array("H", data)
+    if sys.byteorder != "little":
+        vals.byteswap()
+    return vals.tobytes()
 
 
 def ptr_to_u8(val: int) -> bytes:
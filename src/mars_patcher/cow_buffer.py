@@ -0,0 +1,174 @@
+import struct
+from typing import overload
+
+PAGE_SHIFT = 12
+PAGE_SIZE = 1 << PAGE_SHIFT
+"""The size of the pages that are shared between forked buffers (4 KB)."""
+PAGE_MASK = PAGE_SIZE - 1
+
+_U16 = struct.Struct("<H")
+_U32 = struct.Struct("<I")
+
+
+class CowBuffer:
+    """
+    A fixed size, bytearray-like buffer that shares its contents with a base buffer.
+    The data is split into pages, and a page is only copied the first time it is written to,
+    so any number of buffers can share one base buffer while only paying for the pages they
+    change. The base buffer must not be modified while any CowBuffer refers to it.
+    """
+
+    def __init__(
+        self,
+        base: bytes | bytearray | memoryview,
+        pages: dict[int, bytearray] | None = None,
+    ):
+        self._base = memoryview(base)
+        self._size = len(self._base)
+        # Keys are page indexes, values are the private copies of those pages
+        self._pages: dict[int, bytearray] = {} if pages is None else pages
+
+    def __len__(self) -> int:
+        return self._size
+
+    @overload
+    def __getitem__(self, key: int) -> int: ...
+
+    @overload
+    def __getitem__(self, key: slice) -> bytearray: ...
+
+    def __getitem__(self, key: int | slice) -> int | bytearray:
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self._size)
+            if step != 1:
+                return bytearray(self[i] for i in range(start, stop, step))
+            return self._read(start, stop)
+        if key < 0:
+            key += self._size
+        if not 0 <= key < self._size:
+            raise IndexError("CowBuffer index out of range")
+        page = self._pages.get(key >> PAGE_SHIFT)
+        if page is None:
+            return self._base[key]
+        return page[key & PAGE_MASK]
+
+    @overload
+    def __setitem__(self, key: int, value: int) -> None: ...
+
+    @overload
+    def __setitem__(self, key: slice, value: bytes | bytearray | memoryview) -> None: ...
+
+    def __setitem__(self, key: int | slice, value: int | bytes | bytearray | memoryview) -> None:
+        if isinstance(key, slice):
+            assert not isinstance(value, int)
+            start, stop, step = key.indices(self._size)
+            if step != 1:
+                raise ValueError("CowBuffer only supports contiguous slice assignment")
+            self._write(start, max(stop, start), value)
+            return
+        assert isinstance(value, int)
+        if key < 0:
+            key += self._size
+        if not 0 <= key < self._size:
+            raise IndexError("CowBuffer index out of range")
+        self._writable_page(key >> PAGE_SHIFT)[key & PAGE_MASK] = value
+
+    def read_u8(self, addr: int) -> int:
+        """Reads a byte. Faster than indexing, since the address is not checked."""
+        page = self._pages.get(addr >> PAGE_SHIFT)
+        if page is None:
+            return self._base[addr]
+        return page[addr & PAGE_MASK]
+
+    def read_u16(self, addr: int) -> int:
+        """Reads a little endian 16-bit integer."""
+        return self._unpack(_U16, addr)
+
+    def read_u32(self, addr: int) -> int:
+        """Reads a little endian 32-bit integer."""
+        return self._unpack(_U32, addr)
+
+    def _unpack(self, fmt: struct.Struct, addr: int) -> int:
+        offset = addr & PAGE_MASK
+        value: int
+        if offset + fmt.size <= PAGE_SIZE:
+            page = self._pages.get(addr >> PAGE_SHIFT)
+            if page is None:
+                (value,) = fmt.unpack_from(self._base, addr)
+            else:
+                (value,) = fmt.unpack_from(page, offset)
+        else:
+            # The value is split between two pages
+            (value,) = fmt.unpack(self._read(addr, addr + fmt.size))
+        return value
+
+    def _read(self, start: int, stop: int) -> bytearray:
+        if stop <= start:
+            return bytearray()
+        first_page = start >> PAGE_SHIFT
+        last_page = (stop - 1) >> PAGE_SHIFT
+        # Fast path when none of the pages have been copied
+        if not self._pages or all(p not in self._pages for p in range(first_page, last_page + 1)):
+            return bytearray(self._base[start:stop])
+        output = bytearray()
+        for p in range(first_page, last_page + 1):
+            page_start = p << PAGE_SHIFT
+            lo = max(start, page_start) - page_start
+            hi = min(stop, page_start + PAGE_SIZE) - page_start
+            page = self._pages.get(p)
+            if page is None:
+                output += self._base[page_start + lo : page_start + hi]
+            else:
+                output += page[lo:hi]
+        return output
+
+    def _write(self, start: int, stop: int, value: bytes | bytearray | memoryview) -> None:
+        if len(value) != stop - start:
+            raise ValueError("CowBuffer cannot change size")
+        src = memoryview(value)
+        addr = start
+        while addr < stop:
+            page_start = addr & ~PAGE_MASK
+            end = min(stop, page_start + PAGE_SIZE)
+            page = self._writable_page(addr >> PAGE_SHIFT)
+            page[addr - page_start : end - page_start] = src[addr - start : end - start]
+            addr = end
+
+    def _writable_page(self, index: int) -> bytearray:
+        page = self._pages.get(index)
+        if page is None:
+            start = index << PAGE_SHIFT
+            page = bytearray(self._base[start : start + PAGE_SIZE])
+            self._pages[index] = page
+        return page
+
+    def fork(self) -> "CowBuffer":
+        """
+        Returns a new buffer with the same contents. The base buffer is shared, and only the
+        pages that were already copied by this buffer are duplicated.
+        """
+        pages = {p: bytearray(page) for p, page in self._pages.items()}
+        return CowBuffer(self._base, pages)
+
+    def unmodified_view(self) -> memoryview | None:
+        """Returns the base buffer if no pages have been copied, so it can be read directly."""
+        return None if self._pages else self._base
+
+    def release(self) -> None:
+        """Releases the view of the base buffer. The buffer can't be used afterwards."""
+        self._base.release()
+
+    def private_page_count(self) -> int:
+        """Returns how many pages have been copied from the base buffer."""
+        return len(self._pages)
+
+    def flatten(self) -> bytearray:
+        """Returns the full contents of the buffer as a new bytearray."""
+        output = bytearray(self._base)
+        for p, page in self._pages.items():
+            start = p << PAGE_SHIFT
+            output[start : start + len(page)] = page
+        return output
+
+    def __bytes__(self) -> bytes:
+        return bytes(self.flatten())
@@ -0,0 +1,85 @@
+import mars_patcher.constants.game_data as gd
+from mars_patcher.common_types import BytesLike
+from mars_patcher.door_entry import DOOR_ENTRY_SIZE, area_door_entries
+from mars_patcher.free_space import PADDING_GUARD_SIZE
+from mars_patcher.mf.connections import AREA_CONNECTION
+from mars_patcher.mf.constants.game_data import (
+    hatch_lock_event_count,
+    hatch_lock_events,
+    sax_palettes,
+    sprite_vram_sizes,
+)
+from mars_patcher.palette import PAL_ROW_SIZE
+from mars_patcher.patching import find_changed_ranges
+from mars_patcher.rom import Game, Rom
+from mars_patcher.sounds import SOUND_SIZE
+from mars_patcher.text import KANJI_START
+from mars_patcher.tileset import ANIM_TILESET_SIZE, TILESET_SIZE
+
+AREA_COUNT = 7
+"""The number of areas in each game."""
+HATCH_LOCK_EVENT_SIZE = 5
+ZM_VANILLA_DATA_END = 0x760D38
+"""The end of the vanilla data in ZM. Anything after it was added by the base patch."""
+
+
+def data_table_ranges(
+    rom: Rom, unpatched_data: BytesLike | memoryview | None = None
+) -> list[tuple[int, int]]:
+    """
+    Returns the (start, end) of each known data table, such as pointer tables, entry lists,
+    and palettes, along with the space used by the base patch. Padding within these ranges
+    may be part of the data, so it should not be used as free space.
+
+    Args:
+        rom: The ROM, with the base patch applied.
+        unpatched_data: The data before the base patch was applied. For MF, this is compared
+            with the current data to find the space used by the base patch.
+
+    Raises:
+        ValueError: If the ROM is MF and the unpatched data is not provided.
+    """
+    if rom.game == Game.MF and unpatched_data is None:
+        raise ValueError("The unpatched data is needed to find the space used by the base patch")
+    sprite_gfx_count = gd.sprite_count(rom) - 0x10
+    tables = [
+        (gd.area_room_entry_ptrs(rom), AREA_COUNT * 4),
+        (gd.area_doors_ptrs(rom), AREA_COUNT * 4),
+        (gd.minimap_ptrs(rom), gd.minimap_count(rom) * 4),
+        (gd.tileset_entries(rom), gd.tileset_count(rom) * TILESET_SIZE),
+        # Includes the final entry of FFs
+        (gd.area_connections(rom), (gd.area_connections_count(rom) + 1) * AREA_CONNECTION.size),
+        (gd.anim_palette_entries(rom), gd.anim_palette_count(rom) * 8),
+        (gd.sprite_graphics_ptrs(rom), sprite_gfx_count * 4),
+        (gd.sprite_palette_ptrs(rom), sprite_gfx_count * 4),
+        (gd.spriteset_ptrs(rom), gd.spriteset_count(rom) * 4),
+        (gd.sound_data_entries(rom), gd.sound_count(rom) * SOUND_SIZE),
+        (gd.character_widths(rom), KANJI_START),
+    ]
+    palettes = gd.samus_palettes(rom) + gd.helmet_cursor_palettes(rom) + gd.beam_palettes(rom)
+    if rom.game == Game.MF:
+        tables += [
+            (hatch_lock_events(rom), hatch_lock_event_count(rom) * HATCH_LOCK_EVENT_SIZE),
+            (sprite_vram_sizes(rom), sprite_gfx_count * 4),
+        ]
+        palettes += sax_palettes(rom)
+    elif rom.game == Game.ZM:
+        tables.append(
+            (gd.anim_tileset_entries(rom), gd.anim_tileset_count(rom) * ANIM_TILESET_SIZE)
+        )
+    tables += [(addr, rows * PAL_ROW_SIZE) for addr, rows in palettes]
+
+    ranges = [(addr, addr + size) for addr, size in tables]
+    doors_ptrs = gd.area_doors_ptrs(rom)
+    for area in range(AREA_COUNT):
+        addr = rom.read_ptr(doors_ptrs + area * 4)
+        # Includes the entry that ends the list
+        count = sum(1 for _ in area_door_entries(rom, area)) + 1
+        ranges.append((addr, addr + count * DOOR_ENTRY_SIZE))
+    # Code and data added by the base patch
+    if rom.game == Game.MF:
+        assert unpatched_data is not None
+        ranges += find_changed_ranges(unpatched_data, rom.flat_data(), max_gap=PADDING_GUARD_SIZE)
+    elif rom.game == Game.ZM:
+        ranges.append((ZM_VANILLA_DATA_END, rom.free_space_start))
+    return sorted(ranges)
@@ -0,0 +1,73 @@
+import hashlib
+
+from mars_patcher.common_types import BytesLike
+
+
+class DedupIndex:
+    """
+    Remembers where data was placed by a hash of its contents, so identical data can share a
+    single copy in the ROM. Shared data is reference counted, so it's never modified in place
+    or freed while more than one set of pointers uses it.
+    """
+
+    def __init__(self) -> None:
+        self._addrs: dict[bytes, int] = {}
+        self._keys: dict[int, bytes] = {}
+        # Number of owners for each address that has more than one owner
+        self._refs: dict[int, int] = {}
+        self.saved_size = 0
+        """The total size of data that was shared instead of written again."""
+
+    @staticmethod
+    def key(vals: BytesLike) -> bytes:
+        return hashlib.blake2b(vals, digest_size=16).digest()
+
+    def find(self, key: bytes) -> int | None:
+        """Returns the address where data with the provided key was placed, if any."""
+        return self._addrs.get(key)
+
+    def add(self, key: bytes, addr: int) -> None:
+        """Records that data with the provided key was placed at an address."""
+        self.forget(addr)
+        self._addrs[key] = addr
+        self._keys[addr] = key
+
+    def share(self, addr: int, size: int) -> None:
+        """Records that another set of pointers now uses the data at an address."""
+        self._refs[addr] = self._refs.get(addr, 1) + 1
+        self.saved_size += size
+
+    def is_shared(self, addr: int) -> bool:
+        return addr in self._refs
+
+    def release(self, addr: int) -> None:
+        """Records that one set of pointers no longer uses the shared data at an address."""
+        count = self._refs.pop(addr) - 1
+        if count > 1:
+            self._refs[addr] = count
+
+    def forget(self, addr: int) -> None:
+        """Removes the data at an address from the index, e.g. when it's freed."""
+        key = self._keys.pop(addr, None)
+        if key is not None and self._addrs.get(key) == addr:
+            del self._addrs[key]
+        self._refs.pop(addr, None)
+
+    def move(self, old_addr: int, new_addr: int) -> None:
+        """Records that the data at an address was moved to a new address."""
+        key = self._keys.pop(old_addr, None)
+        if key is not None:
+            self._keys[new_addr] = key
+            if self._addrs.get(key) == old_addr:
+                self._addrs[key] = new_addr
+        refs = self._refs.pop(old_addr, None)
+        if refs is not None:
+            self._refs[new_addr] = refs
+
+    def copy(self) -> "DedupIndex":
+        other = DedupIndex()
+        other._addrs = self._addrs.copy()
+        other._keys = self._keys.copy()
+        other._refs = self._refs.copy()
+        other.saved_size = self.saved_size
+        return other
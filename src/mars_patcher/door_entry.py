@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, NamedTuple
+
+from mars_patcher.constants.game_data import area_doors_ptrs
+from mars_patcher.record_view import RecordLayout
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+    from mars_patcher.rom import Rom
+
+DOOR_ENTRY_SIZE = 0xC
+MAX_AREA_DOORS = 256
+
+
+class DoorEntry(NamedTuple):
+    """A door entry, as stored in each area's list of doors."""
+
+    properties: int
+    """The door type in the low 4 bits, and flags in the high 4 bits."""
+    src_room: int
+    x_start: int
+    x_end: int
+    y_start: int
+    y_end: int
+    dst_door: int
+    x_exit: int
+    """Signed distance from the door where Samus exits; negative when exiting to the left."""
+    y_exit: int
+    unk_9: bytes
+
+
+DOOR_ENTRY = RecordLayout(DoorEntry, "7B2b3s")
+
+
+def door_entry_addr(rom: Rom, area: int, door: int) -> int:
+    """Returns the address of a door entry."""
+    return rom.read_ptr(area_doors_ptrs(rom) + area * 4) + door * DOOR_ENTRY_SIZE
+
+
+def area_door_entries(rom: Rom, area: int) -> Iterator[DoorEntry]:
+    """Yields the door entries of an area in order, stopping at the end of the list."""
+    addr = rom.read_ptr(area_doors_ptrs(rom) + area * 4)
+    for entry in rom.iter_records(DOOR_ENTRY, addr, MAX_AREA_DOORS):
+        if entry.properties == 0:
+            return
+        yield entry
@@ -0,0 +1,72 @@
+import json
+import os
+from os import PathLike
+
+FINGERPRINT_FILE = "fingerprints.json"
+"""The name of the fingerprint cache file within a cache directory."""
+
+MAX_FINGERPRINTS = 64
+"""The number of fingerprints kept; the oldest ones are dropped first."""
+
+
+def file_fingerprint(path: str | PathLike[str]) -> str | None:
+    """
+    Returns a fingerprint of a file made from its path, size, modification time, and inode,
+    or None if the file can't be accessed. A file with the same fingerprint is trusted to have
+    the same contents.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}|{stat.st_ino}"
+
+
+class FingerprintCache:
+    """
+    Remembers the CRC32 of files that were already verified, keyed by their fingerprint, so
+    later runs can trust a file that hasn't changed without reading all of it to compute its
+    checksum. The cache is stored as a JSON file, and is only an optimization; a missing or
+    invalid file is treated as empty, and failing to write it is ignored.
+    """
+
+    def __init__(self, path: str | PathLike[str]):
+        self.path = path
+        self._entries = self._read()
+
+    def _read(self) -> dict[str, int]:
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(entries, dict):
+            return {}
+        return {k: v for k, v in entries.items() if isinstance(v, int)}
+
+    def get(self, fingerprint: str | None) -> int | None:
+        """Returns the checksum of the file with the provided fingerprint, if it's known."""
+        if fingerprint is None:
+            return None
+        return self._entries.get(fingerprint)
+
+    def put(self, fingerprint: str | None, checksum: int) -> None:
+        """Records the checksum of the file with the provided fingerprint."""
+        if fingerprint is None:
+            return
+        # Merge with entries written by other processes since the cache was read
+        entries = self._read()
+        entries.pop(fingerprint, None)
+        entries[fingerprint] = checksum
+        while len(entries) > MAX_FINGERPRINTS:
+            del entries[next(iter(entries))]
+        self._entries = entries
+        # Write to a temporary file first, so other processes never see a partial file
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(temp_path, "w") as f:
+                json.dump(entries, f)
+            os.replace(temp_path, self.path)
+        except OSError:
+            pass
@@ -0,0 +1,171 @@
+import re
+from bisect import bisect_left, insort
+from dataclasses import dataclass, field
+
+from mars_patcher.range_set import RangeSet
+
+ALIGNMENT = 4
+
+PADDING_MIN_SIZE = 0x1000
+"""The minimum length of a run of padding bytes for it to be considered free space."""
+PADDING_GUARD_SIZE = 0x10
+"""Bytes skipped at the start of padding, in case they belong to the data before it."""
+
+
+def align(num: int, alignment: int = ALIGNMENT) -> int:
+    """Rounds a number up to a multiple of the alignment."""
+    remain = num % alignment
+    if remain != 0:
+        num += alignment - remain
+    return num
+
+
+def find_padding(
+    data: bytes | bytearray,
+    start: int,
+    end: int,
+    min_size: int = PADDING_MIN_SIZE,
+    fill_values: tuple[int, ...] = (0xFF,),
+) -> list[tuple[int, int]]:
+    """
+    Returns the sorted (start, end) of every run of a single fill value within [start, end) that
+    is at least the minimum size.
+    """
+    runs: list[tuple[int, int]] = []
+    for val in fill_values:
+        pattern = re.compile(re.escape(bytes([val])) + b"{%d,}" % min_size)
+        runs.extend(m.span() for m in pattern.finditer(data, start, end))
+    return sorted(runs)
+
+
+@dataclass(frozen=True)
+class FreeSpaceStats:
+    """A summary of the free space tracked by a FreeSpaceAllocator."""
+
+    free_size: int
+    """The total size of all free blocks."""
+    block_count: int
+    """The number of free blocks."""
+    largest_block: int
+    """The size of the largest free block."""
+
+    @property
+    def fragmentation(self) -> float:
+        """
+        How fragmented the free space is, from 0 (one block) to almost 1 (many small blocks).
+        This is the fraction of free space that is not part of the largest block.
+        """
+        if self.free_size == 0:
+            return 0.0
+        return 1 - self.largest_block / self.free_size
+
+
+@dataclass
+class Allocation:
+    """Data that was placed in free space along with the locations of its pointers."""
+
+    size: int
+    """The size of the space used by the data."""
+    pointers: list[int] = field(default_factory=list)
+    """The locations of the pointers to the data."""
+
+
+class FreeSpaceAllocator:
+    """
+    Tracks free blocks of ROM space and allocates from them using best fit. Blocks are kept
+    sorted both by address, so neighbouring blocks are merged when space is freed, and by size,
+    so the smallest block that fits can be found with a binary search. Keeping the lists sorted
+    still costs O(n) per insertion or removal, which is cheap for the few hundred blocks a ROM
+    has. All allocations are aligned to 4 bytes.
+    """
+
+    def __init__(self) -> None:
+        self._blocks = RangeSet()
+        # Sorted (size, address) pairs for every block in _blocks
+        self._by_size: list[tuple[int, int]] = []
+
+    def free(self, addr: int, size: int) -> None:
+        """Marks space as free, merging it with any free blocks it touches."""
+        start = align(addr)
+        end = addr + size
+        if end - start < ALIGNMENT:
+            return
+        for block_start, block_end in self._blocks.touching(start, end):
+            self._remove_by_size(block_start, block_end)
+            start = min(start, block_start)
+            end = max(end, block_end)
+        self._blocks.add(start, end)
+        insort(self._by_size, (end - start, start))
+
+    def reserve(self, addr: int, size: int) -> None:
+        """Marks space as used, so it will not be allocated."""
+        end = addr + size
+        for block_start, block_end in self._blocks.touching(addr, end):
+            if block_end <= addr or block_start >= end:
+                # Only adjacent
+                continue
+            self._remove_by_size(block_start, block_end)
+            self._blocks.remove(block_start, block_end)
+            if block_start < addr:
+                self.free(block_start, addr - block_start)
+            if block_end > end:
+                self.free(end, block_end - end)
+
+    def allocate(self, size: int) -> int | None:
+        """
+        Returns the address of the smallest free block that fits the specified size, and marks
+        that space as used. Returns None if no free block is large enough.
+        """
+        i = bisect_left(self._by_size, (size, -1))
+        if i == len(self._by_size):
+            return None
+        block_size, addr = self._by_size.pop(i)
+        block_end = addr + block_size
+        self._blocks.remove(addr, block_end)
+        # Return the remaining space
+        remain_addr = align(addr + size)
+        if block_end - remain_addr >= ALIGNMENT:
+            self._blocks.add(remain_addr, block_end)
+            insort(self._by_size, (block_end - remain_addr, remain_addr))
+        return addr
+
+    def _remove_by_size(self, start: int, end: int) -> None:
+        i = bisect_left(self._by_size, (end - start, start))
+        del self._by_size[i]
+
+    def blocks(self) -> list[tuple[int, int]]:
+        """Returns the (start, end) of every free block, sorted by address."""
+        return list(self._blocks)
+
+    def block_containing(self, addr: int) -> tuple[int, int] | None:
+        """Returns the (start, end) of the free block containing the address, if any."""
+        return self._blocks.range_containing(addr)
+
+    def used_ranges(self, start: int, end: int) -> list[tuple[int, int]]:
+        """Returns the (start, end) of every range within [start, end) that is not free."""
+        ranges = []
+        pos = start
+        for block_start, block_end in self._blocks.touching(start, end):
+            if block_start > pos:
+                ranges.append((pos, min(block_start, end)))
+            pos = max(pos, block_end)
+        if pos < end:
+            ranges.append((pos, end))
+        return ranges
+
+    def free_size_in(self, start: int, end: int) -> int:
+        """Returns how much of [start, end) is free."""
+        size = 0
+        for block_start, block_end in self._blocks.touching(start, end):
+            size += max(0, min(end, block_end) - max(start, block_start))
+        return size
+
+    def stats(self) -> FreeSpaceStats:
+        largest = self._by_size[-1][0] if self._by_size else 0
+        return FreeSpaceStats(self._blocks.total_size(), len(self._by_size), largest)
+
+    def copy(self) -> "FreeSpaceAllocator":
+        other = FreeSpaceAllocator()
+        other._blocks = self._blocks.copy()
+        other._by_size = self._by_size.copy()
+        return other
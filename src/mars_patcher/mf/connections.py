@@ -1,6 +1,8 @@
 from collections.abc import Sequence
+from typing import NamedTuple
 
 import mars_patcher.constants.game_data as gd
+from mars_patcher.door_entry import DOOR_ENTRY, door_entry_addr
 from mars_patcher.mf.auto_generated_types import (
     MarsschemamfElevatorConnections,
     MarsschemamfSectorShortcuts,
@@ -21,6 +23,7 @@ from mars_patcher.mf.constants.main_hub_numbers import (
     MAIN_HUB_TILEMAP_ADDR,
 )
 from mars_patcher.mf.data import get_data_path
+from mars_patcher.record_view import RecordLayout
 from mars_patcher.rom import Game, Rom
 from mars_patcher.room_entry import BlockLayer, RoomEntry
 from mars_patcher.tilemap import Tilemap
@@ -65,20 +68,28 @@ DOOR_TYPE_AREA_CONN = 1
 DOOR_TYPE_NO_HATCH = 2
 
 
+class AreaConnection(NamedTuple):
+    src_area: int
+    src_door: int
+    dst_area: int
+
+
+AREA_CONNECTION = RecordLayout(AreaConnection, "3B")
+
+
 class Connections:
     """Class for handling elevator shuffle and sector shortcut shuffle."""
 
     def __init__(self, rom: Rom):
         self.rom = rom
-        self.area_doors_ptrs = gd.area_doors_ptrs(rom)
         self.area_conns_addr = gd.area_connections(rom)
         self.area_conns_count = gd.area_connections_count(rom)
 
     def set_elevator_connections(self, data: MarsschemamfElevatorConnections) -> None:
         # Reserve space for 8 more area connections and repoint
-        size = self.area_conns_count * 3
+        size = self.area_conns_count * AREA_CONNECTION.size
         ac_data = self.rom.read_bytes(self.area_conns_addr, size)
-        ac_data += bytearray(8 * 3)
+        ac_data += bytearray(8 * AREA_CONNECTION.size)
         # TODO: Move pointer constant
         self.area_conns_addr = self.rom.write_repointable_data(
             self.area_conns_addr, size, ac_data, [0x6945C]
@@ -120,8 +131,8 @@ class Connections:
         self.connect_areas(area, door, dst_area, True)
 
         # Update area numbers on BG1
-        addr = self.rom.read_ptr(self.area_doors_ptrs + area * 4) + door * 0xC
-        room = self.rom.read_8(addr + 1)
+        addr = door_entry_addr(self.rom, area, door)
+        room = self.rom.read_record(DOOR_ENTRY, addr).src_room
         room_entry = RoomEntry(self.rom, area, room)
         with room_entry.load_bg1() as bg1:
             block = SHORTCUT_NUM_BLOCKS[left_area - 1]
@@ -148,50 +159,46 @@ class Connections:
             self.connect_areas(src_area, src_door, dst_area, in_list)
 
     def connect_doors(self, src_area: int, src_door: int, dst_area: int, dst_door: int) -> None:
-        addr = self.rom.read_ptr(self.area_doors_ptrs + src_area * 4) + src_door * 0xC
-        # Fix door type
-        props = self.rom.read_8(addr)
+        addr = door_entry_addr(self.rom, src_area, src_door)
+        entry = self.rom.read_record(DOOR_ENTRY, addr)
+        # Fix door type and set destination door
         door_type = DOOR_TYPE_AREA_CONN if src_area != dst_area else DOOR_TYPE_NO_HATCH
-        self.rom.write_8(addr, props & 0xF0 | door_type)
-        # Set destination door
-        self.rom.write_8(addr + 6, dst_door)
+        entry = entry._replace(properties=entry.properties & 0xF0 | door_type, dst_door=dst_door)
+        self.rom.write_record(DOOR_ENTRY, addr, entry)
 
     def connect_areas(self, src_area: int, src_door: int, dst_area: int, in_list: bool) -> None:
         rom = self.rom
         same_area = src_area == dst_area
         if in_list:
             # Find existing area connection
-            for i in range(self.area_conns_count):
-                addr = self.area_conns_addr + i * 3
-                if rom.read_8(addr) == src_area and rom.read_8(addr + 1) == src_door:
+            conns = rom.read_records(AREA_CONNECTION, self.area_conns_addr, self.area_conns_count)
+            for i, conn in enumerate(conns):
+                if conn.src_area == src_area and conn.src_door == src_door:
+                    addr = self.area_conns_addr + i * AREA_CONNECTION.size
                     if same_area:
                         # Make entry blank
-                        rom.write_8(addr, 0)
-                        rom.write_8(addr + 1, 0)
-                        rom.write_8(addr + 2, 0)
+                        conn = AreaConnection(0, 0, 0)
                     else:
-                        rom.write_8(addr + 2, dst_area)
+                        conn = conn._replace(dst_area=dst_area)
+                    rom.write_record(AREA_CONNECTION, addr, conn)
                     return
             raise ValueError(f"Area connection not found for Area {src_area} Door {src_door:02X}")
         elif not same_area:
-            addr = self.area_conns_addr + self.area_conns_count * 3
-            rom.write_8(addr, src_area)
-            rom.write_8(addr + 1, src_door)
-            rom.write_8(addr + 2, dst_area)
+            addr = self.area_conns_addr + self.area_conns_count * AREA_CONNECTION.size
+            rom.write_record(AREA_CONNECTION, addr, AreaConnection(src_area, src_door, dst_area))
             self.area_conns_count += 1
 
     def fix_main_hub_tiles(self) -> None:
         # Get areas that the 6 elevators go to
         ele_areas = [0 for _ in MAIN_HUB_ELE_DOORS]
-        for i in range(self.area_conns_count):
-            addr = self.area_conns_addr + i * 3
+        conns = self.rom.read_records(AREA_CONNECTION, self.area_conns_addr, self.area_conns_count)
+        for conn in conns:
             # Skip if not main deck
-            if self.rom.read_8(addr) != 0:
+            if conn.src_area != 0:
                 continue
-            door = self.rom.read_8(addr + 1)
             for j, ele_door in enumerate(MAIN_HUB_ELE_DOORS):
-                if door == ele_door:
-                    ele_areas[j] = self.rom.read_8(addr + 2)
+                if conn.src_door == ele_door:
+                    ele_areas[j] = conn.dst_area
                     break
 
         # Write new graphics and tilemap
@@ -7,6 +7,7 @@ from mars_patcher.common_types import AreaId, AreaRoomPair
 from mars_patcher.constants.door_types import DoorType
 from mars_patcher.constants.game_data import area_doors_ptrs, minimap_graphics
 from mars_patcher.constants.minimap_tiles import ColoredDoor, Content, Edge
+from mars_patcher.door_entry import DOOR_ENTRY_SIZE, area_door_entries
 from mars_patcher.mf.auto_generated_types import MarsschemamfDoorLocksItem
 from mars_patcher.mf.constants.game_data import hatch_lock_event_count, hatch_lock_events
 from mars_patcher.mf.constants.minimap_tiles import (
@@ -112,16 +113,12 @@ def set_door_locks(rom: Rom, data: list[MarsschemamfDoorLocksItem]) -> None:
 
     for area in range(7):
         area_addr = rom.read_ptr(doors_ptrs + area * 4)
-        for door in range(256):
-            door_addr = area_addr + door * 0xC
-            door_properties = rom.read_8(door_addr)
-
-            # Check if at end of list
-            if door_properties == 0:
-                break
+        for door, door_entry in enumerate(area_door_entries(rom, area)):
+            door_addr = area_addr + door * DOOR_ENTRY_SIZE
+            door_properties = door_entry.properties
 
             # Skip doors that mage or asm marks as deleted
-            room = rom.read_8(door_addr + 1)
+            room = door_entry.src_room
             if room == 0xFF:
                 continue
 
@@ -167,13 +164,12 @@ def set_door_locks(rom: Rom, data: list[MarsschemamfDoorLocksItem]) -> None:
                     bg1, clip = _tuple
 
             # Check x exit distance to get facing direction
-            x_exit = rom.read_8(door_addr + 7)
-            facing_right = x_exit < 0x80
+            facing_right = door_entry.x_exit >= 0
             dx = 1 if facing_right else -1
 
             # Get hatch position
-            hatch_x = rom.read_8(door_addr + 2) + dx
-            hatch_y = rom.read_8(door_addr + 4)
+            hatch_x = door_entry.x_start + dx
+            hatch_y = door_entry.y_start
 
             # Get original hatch slot number
             capped_slot, capless_slot = orig_room_hatch_slots[area_room]
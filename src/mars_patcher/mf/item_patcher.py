@@ -1,8 +1,11 @@
+from typing import NamedTuple
+
 from mars_patcher.item_messages import ItemMessages, ItemMessagesKind
 from mars_patcher.mf.auto_generated_types import MarsschemamfTankIncrements
 from mars_patcher.mf.constants.items import ItemSprite, ItemType
 from mars_patcher.mf.constants.reserved_space import ReservedConstantsMF, ReservedPointersMF
 from mars_patcher.mf.locations import LocationSettings
+from mars_patcher.record_view import RecordLayout
 from mars_patcher.rom import Rom
 from mars_patcher.room_entry import RoomEntry
 from mars_patcher.text import Language, MessageType, encode_text
@@ -25,6 +28,24 @@ TANK_BG1_START = 0x40
 TANK_TILE = (0x50, 0x54, 0x58)
 
 
+class MinorLocationEntry(NamedTuple):
+    """An entry in the array of minor locations that the assembly reads items from."""
+
+    area: int
+    room: int
+    unk_2: int
+    block_x: int
+    block_y: int
+    item: int
+    item_sprite: int
+    message: int
+    jingle: int
+    unk_9: bytes
+
+
+MINOR_LOC_ENTRY = RecordLayout(MinorLocationEntry, "9B7s")
+
+
 class ItemPatcher:
     """Class for writing item assignments to a ROM."""
 
@@ -113,25 +134,24 @@ class ItemPatcher:
             while not found_item:
                 item_index += 1
                 item_addr = MINOR_LOCS_ARRAY + ((room_entry_index + item_index) * MINOR_LOC_SIZE)
-                read_area = rom.read_8(item_addr)
-                read_room = rom.read_8(item_addr + 1)
-                read_block_x = rom.read_8(item_addr + 3)
-                read_block_y = rom.read_8(item_addr + 4)
+                entry = rom.read_record(MINOR_LOC_ENTRY, item_addr)
 
-                assert read_area == min_loc.area, (
-                    f"area was '{read_area}', but was expected to be {min_loc.area}"
+                assert entry.area == min_loc.area, (
+                    f"area was '{entry.area}', but was expected to be {min_loc.area}"
+                )
+                assert entry.room == min_loc.room, (
+                    f"room was '{entry.room}', but was expected to be {min_loc.room}"
                 )
-                assert read_room == min_loc.room, (
-                    f"room was '{read_room}', but was expected to be {min_loc.room}"
+                found_item = (entry.block_x == min_loc.block_x) and (
+                    entry.block_y == min_loc.block_y
                 )
-                found_item = (read_block_x == min_loc.block_x) and (read_block_y == min_loc.block_y)
 
             assert item_addr != -1
 
             if min_loc.new_item != ItemType.UNDEFINED:
-                rom.write_8(item_addr + 5, min_loc.new_item.value)
+                entry = entry._replace(item=min_loc.new_item.value)
                 if min_loc.item_sprite != ItemSprite.UNCHANGED:
-                    rom.write_8(item_addr + 6, min_loc.item_sprite.value)
+                    entry = entry._replace(item_sprite=min_loc.item_sprite.value)
             # Handle item messages
             if min_loc.item_messages is not None:
                 messages = min_loc.item_messages
@@ -139,7 +159,7 @@ class ItemPatcher:
                 if messages.kind == ItemMessagesKind.CUSTOM_MESSAGE:
                     # If we already encountered the message before, write the existing message id.
                     if messages in item_messages_to_custom_id:
-                        rom.write_8(item_addr + 7, item_messages_to_custom_id[messages])
+                        entry = entry._replace(message=item_messages_to_custom_id[messages])
                     else:
                         self.write_custom_message(
                             custom_message_id,
@@ -148,13 +168,15 @@ class ItemPatcher:
                             min_loc.item_messages,
                             False,
                         )
+                        entry = entry._replace(message=custom_message_id)
                         item_messages_to_custom_id[messages] = custom_message_id
                         custom_message_id += 1
                 # If the kind is Message ID, write that ID
                 else:
-                    rom.write_8(item_addr + 7, messages.message_id)
+                    entry = entry._replace(message=messages.message_id)
             # Write item jingle
-            rom.write_8(item_addr + 8, min_loc.item_jingle.value)
+            entry = entry._replace(jingle=min_loc.item_jingle.value)
+            rom.write_record(MINOR_LOC_ENTRY, item_addr, entry)
         # Handle major locations
         for maj_loc in self.settings.major_locs:
             # Write to majors table
@@ -1,10 +1,18 @@
+import os
+from os import PathLike
+from zlib import crc32
+
 import mars_patcher.constants.game_data as gd
+from mars_patcher.fingerprint import FINGERPRINT_FILE, FingerprintCache, file_fingerprint
 from mars_patcher.mf.auto_generated_types import MarsschemamfEnvironmentalDamage
 from mars_patcher.mf.constants.reserved_space import ReservedPointersMF
 from mars_patcher.mf.data import get_data_path
 from mars_patcher.patching import BpsDecoder, IpsDecoder
 from mars_patcher.rom import Rom
 
+MAX_BASE_PATCH_ENTRIES = 4
+"""The number of base patched ROMs kept in the cache for each game and region."""
+
 
 def _get_patch_path(rom: Rom, subfolder: str, filename: str) -> str:
     dir = f"{rom.game.name}_{rom.region.name}".lower()
@@ -15,7 +23,8 @@ def _internal_apply_ips_patch(rom: Rom, patch_name: str, subfolder: str) -> None
     path = _get_patch_path(rom, subfolder, patch_name)
     with open(path, "rb") as f:
         patch = f.read()
-    IpsDecoder().apply_patch(patch, rom.data)
+    for addr, vals in IpsDecoder().read_records(patch, len(rom.data)):
+        rom.write_bytes(addr, vals)
 
 
 def apply_patch_in_data_path(rom: Rom, patch_name: str) -> None:
@@ -26,11 +35,108 @@ def apply_patch_in_asm_path(rom: Rom, patch_name: str) -> None:
     _internal_apply_ips_patch(rom, patch_name, "asm")
 
 
-def apply_base_patch(rom: Rom) -> None:
+def _base_patch_cache_path(
+    rom: Rom, cache_dir: str | PathLike[str], rom_crc: int, patch_crc: int
+) -> str:
+    prefix = f"{rom.game.name}_{rom.region.name}".lower()
+    return os.path.join(cache_dir, f"{prefix}_{rom_crc:08x}_{patch_crc:08x}.gba")
+
+
+def _load_cached_base_patch(
+    path: str, patch: bytes, fingerprints: FingerprintCache
+) -> bytearray | None:
+    """
+    Loads a cached base patched ROM. Returns None if the cache entry is missing or does not
+    match the target checksum stored in the patch. The checksum is not computed again if the
+    entry's fingerprint shows it was already verified.
+    """
+    fingerprint = file_fingerprint(path)
+    try:
+        with open(path, "rb") as f:
+            data = bytearray(f.read())
+    except OSError:
+        return None
+    target_checksum = int.from_bytes(patch[-8:-4], "little")
+    if fingerprints.get(fingerprint) == target_checksum:
+        return data
+    if crc32(data) != target_checksum:
+        return None
+    fingerprints.put(fingerprint, target_checksum)
+    return data
+
+
+def _store_cached_base_patch(path: str, data: bytearray) -> None:
+    """
+    Writes a base patched ROM to the cache, and removes the oldest entries for the same game
+    and region once there are more than MAX_BASE_PATCH_ENTRIES. Entries for other input ROMs
+    or versions of the base patch are kept, so processes using different versions of the
+    patcher with the same cache directory don't remove each other's entries.
+    """
+    cache_dir, name = os.path.split(path)
+    os.makedirs(cache_dir, exist_ok=True)
+    # Write to a temporary file first, so other processes never see a partial entry
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(data)
+    os.replace(temp_path, path)
+    # The name is <game>_<region>_<rom crc>_<patch crc>.gba
+    prefix = name.rsplit("_", 2)[0] + "_"
+    entries = []
+    for entry in os.listdir(cache_dir):
+        if entry.startswith(prefix) and entry.endswith(".gba"):
+            entry_path = os.path.join(cache_dir, entry)
+            try:
+                entries.append((os.stat(entry_path).st_mtime, entry_path))
+            except OSError:
+                pass
+    entries.sort(reverse=True)
+    for _, entry_path in entries[MAX_BASE_PATCH_ENTRIES:]:
+        if entry_path == path:
+            continue
+        try:
+            os.remove(entry_path)
+        except OSError:
+            pass
+
+
+def apply_base_patch(rom: Rom, cache_dir: str | PathLike[str] | None = None) -> None:
+    """
+    Applies the base asm patch. If a cache directory is provided, the patched ROM is stored
+    there, keyed by the checksums of the input ROM and the patch file, and loaded directly on
+    later runs. Updating the patch file changes its checksum, which invalidates old entries.
+    The checksum of the input ROM is not computed if the ROM's checksum is already known.
+    """
     path = _get_patch_path(rom, "asm", "m4rs.bps")
     with open(path, "rb") as f:
         patch = f.read()
-    rom.data = BpsDecoder().apply_patch(patch, rom.data)
+    if cache_dir is None:
+        source = rom.flat_data()
+        rom.replace_data(BpsDecoder().apply_patch(patch, source, source_checksum=rom.checksum))
+        rom.base_patch_applied = True
+        return
+
+    # The last 4 bytes of a BPS file are the checksum of everything before them, so they are
+    # excluded here (the checksum of the full file is the same constant for every patch)
+    patch_crc = crc32(patch[:-4])
+    source = rom.flat_data()
+    if rom.checksum is None:
+        rom.checksum = crc32(source)
+    cache_path = _base_patch_cache_path(rom, cache_dir, rom.checksum, patch_crc)
+    fingerprints = FingerprintCache(os.path.join(cache_dir, FINGERPRINT_FILE))
+    data = _load_cached_base_patch(cache_path, patch, fingerprints)
+    if data is None:
+        data = BpsDecoder().apply_patch(patch, source, source_checksum=rom.checksum)
+        try:
+            _store_cached_base_patch(cache_path, data)
+        except OSError:
+            # Caching is only an optimization, so patching should still succeed
+            pass
+        else:
+            # The decoder checked that the data matches the target checksum
+            target_checksum = int.from_bytes(patch[-8:-4], "little")
+            fingerprints.put(file_fingerprint(cache_path), target_checksum)
+    rom.replace_data(data)
+    rom.base_patch_applied = True
 
 
 def disable_demos(rom: Rom) -> None:
@@ -1,7 +1,9 @@
 import json
 from collections.abc import Callable
 from os import PathLike
+from typing import TYPE_CHECKING, BinaryIO
 
+from mars_patcher.data_tables import data_table_ranges
 from mars_patcher.level_edits import apply_level_edits
 from mars_patcher.mf.auto_generated_types import MarsSchemaMF
 from mars_patcher.mf.connections import Connections
@@ -33,35 +35,74 @@ from mars_patcher.mf.misc_patches import (
 from mars_patcher.mf.navigation_text import NavigationText
 from mars_patcher.mf.starting import set_starting_items, set_starting_location
 from mars_patcher.random_palettes import PaletteRandomizer, PaletteSettings
-from mars_patcher.rom import Rom
+from mars_patcher.rom import OutputFormat, Rom
 from mars_patcher.room_names import write_room_names
 from mars_patcher.sounds import set_sounds
 from mars_patcher.text import write_seed_hash
 from mars_patcher.tilemap import apply_minimap_edits
 from mars_patcher.title_screen_text import write_title_text
 
+if TYPE_CHECKING:
+    from mars_patcher.common_types import BytesLike
+
 
 def patch_mf(
     rom: Rom,
-    output_path: str | PathLike[str],
+    output_path: str | PathLike[str] | BinaryIO,
     patch_data: MarsSchemaMF,
     status_update: Callable[[str, float], None],
+    base_patch_cache_dir: str | PathLike[str] | None = None,
+    output_format: OutputFormat = OutputFormat.ROM,
+    discover_free_space: bool = False,
+    expand_size: int | None = None,
+    compact_free_space: bool = False,
 ) -> None:
     """
     Creates a new randomized Fusion game, based off of an input path, an output path,
     a dictionary defining how the game should be randomized, and a status update function.
 
     Args:
-        rom: Rom object for an unmodified Metroid Fusion (U) ROM.
-        output_path: The path where the randomized Fusion ROM should be saved to.
+        rom: Rom object for an unmodified Metroid Fusion (U) ROM, or one created from a base
+            patched SharedRomImage.
+        output_path: The path or binary file object where the randomized Fusion ROM should be
+            saved to.
         patch_data: A dictionary defining how the game should be randomized.
             This function assumes that it satisfies the needed schema. To validate it, use
             validate_patch_data_mf().
         status_update: A function taking in a message (str) and a progress value (float).
+            A summary of the free space usage is also sent to it before saving.
+        base_patch_cache_dir: An optional directory where the base patched ROM is cached
+            between runs.
+        output_format: Whether to save the full ROM or a patch against the original ROM.
+        discover_free_space: Whether unused padding in the ROM should be added to the free
+            space, in addition to the reserved free space.
+        expand_size: If provided, the ROM is expanded to this size (16 MB or 32 MB), and the
+            new space is used for data that doesn't fit in the reserved free space.
+        compact_free_space: Whether data written to free space should be packed together at
+            the end of patching, leaving one large free block.
+
+    Raises:
+        ValueError: If discovering free space in a ROM created from a base patched image
+            without keeping its original data.
     """
-
-    # Apply base asm patch first
-    apply_base_patch(rom)
+    # Tag journaled writes with the step that made them
+    send_report = status_update
+    if rom.journal is not None:
+        status_update = rom.journal.wrap_status_update(status_update)
+
+    # Apply base asm patch first, unless the ROM was created from a base patched image
+    unpatched_data: BytesLike | memoryview | None = rom.original_data
+    if not rom.base_patch_applied:
+        if discover_free_space:
+            # Compared with the patched data later to find the space used by the base patch
+            unpatched_data = rom.flat_data()
+        rom.set_journal_step("Applying base patch")
+        apply_base_patch(rom, base_patch_cache_dir)
+
+    if discover_free_space:
+        rom.discover_free_space(exclude=data_table_ranges(rom, unpatched_data))
+    if expand_size is not None:
+        rom.expand(expand_size)
 
     # Randomize palettes - palettes are randomized first in case the item
     # patcher needs to copy tilesets
@@ -136,6 +177,7 @@ def patch_mf(
         write_credits(rom, credits_text)
 
     # Misc patches
+    rom.set_journal_step("Applying misc patches")
     if patch_data.get("disable_demos"):
         disable_demos(rom)
 
@@ -176,9 +218,11 @@ def patch_mf(
         apply_reveal_hidden_tiles(rom)
 
     if "level_edits" in patch_data:
+        rom.set_journal_step("Applying level edits")
         apply_level_edits(rom, patch_data["level_edits"])
 
     # Apply base minimap edits
+    rom.set_journal_step("Applying minimap edits")
     with open(get_data_path("base_minimap_edits.json")) as f:
         edits_dict = json.load(f)
     apply_minimap_edits(rom, edits_dict)
@@ -192,6 +236,7 @@ def patch_mf(
         status_update("Writing door locks...", -1)
         set_door_locks(rom, door_locks)
 
+    rom.set_journal_step("Writing seed hash")
     write_seed_hash(rom, patch_data["seed_hash"])
 
     # Title screen text
@@ -199,5 +244,15 @@ def patch_mf(
         status_update("Writing title screen text...", -1)
         write_title_text(rom, title_screen_text)
 
-    rom.save(output_path)
-    status_update(f"Output written to {output_path}", -1)
+    if compact_free_space:
+        status_update("Compacting free space...", -1)
+        rom.compact_free_space()
+
+    # Sent without starting a new journal step, since it's not a patching step
+    send_report(rom.space_report(), -1)
+
+    rom.save(output_path, output_format)
+    if isinstance(output_path, (str, PathLike)):
+        status_update(f"Output written to {output_path}", -1)
+    else:
+        status_update("Output written", -1)
@@ -1,4 +1,5 @@
-from mars_patcher.constants.game_data import area_doors_ptrs, spriteset_ptrs
+from mars_patcher.constants.game_data import spriteset_ptrs
+from mars_patcher.door_entry import area_door_entries
 from mars_patcher.mf.auto_generated_types import (
     MarsschemamfStartingItems,
     MarsschemamfStartingLocation,
@@ -39,18 +40,10 @@ def set_starting_location(rom: Rom, data: MarsschemamfStartingLocation) -> None:
 
 
 def find_door_in_room(rom: Rom, area: int, room: int) -> int:
-    door_addr = rom.read_ptr(area_doors_ptrs(rom) + area * 4)
-    door = None
-    for d in range(256):
-        if rom.read_8(door_addr) == 0:
-            break
-        if rom.read_8(door_addr + 1) == room:
-            door = d
-            break
-        door_addr += 0xC
-    if door is None:
-        raise ValueError(f"No door found for area {area} room {room:X}")
-    return door
+    for door, entry in enumerate(area_door_entries(rom, area)):
+        if entry.src_room == room:
+            return door
+    raise ValueError(f"No door found for area {area} room {room:X}")
 
 
 def find_save_pad_position(rom: Rom, area: int, room: int) -> tuple[int, int] | None:
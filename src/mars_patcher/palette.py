@@ -73,11 +73,10 @@ class ColorChange:
 class Palette:
     def __init__(self, rows: int, rom: Rom, addr: int):
         assert rows >= 1
-        self.colors: list[RgbColor] = []
-        for i in range(rows * PAL_ROW_COUNT):
-            rgb = rom.read_16(addr + i * 2)
-            color = RgbColor.from_rgb(rgb, RgbBitSize.Rgb5)
-            self.colors.append(color)
+        self.colors = [
+            RgbColor.from_rgb(rgb, RgbBitSize.Rgb5)
+            for rgb in rom.read_u16_array(addr, rows * PAL_ROW_COUNT)
+        ]
 
     def __getitem__(self, key: int) -> RgbColor:
         return self.colors[key]
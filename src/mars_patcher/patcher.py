@@ -1,18 +1,26 @@
+import io
 import json
+import os
 import typing
 from collections.abc import Callable
 from os import PathLike
+from typing import BinaryIO
 
 from jsonschema import validate
 
 import mars_patcher.mf.data as data_mf
 import mars_patcher.zm.data as data_zm
+from mars_patcher.compression_cache import CompressionCache
+from mars_patcher.fingerprint import FINGERPRINT_FILE, FingerprintCache, file_fingerprint
 from mars_patcher.mf.auto_generated_types import MarsSchemaMF
 from mars_patcher.mf.patcher import patch_mf
-from mars_patcher.rom import Rom
+from mars_patcher.rom import OutputFormat, Rom
 from mars_patcher.zm.auto_generated_types import MarsSchemaZM
 from mars_patcher.zm.patcher import patch_zm
 
+COMPRESSION_CACHE_DIR = "compressed"
+"""The subdirectory of the cache directory where compressed data is cached."""
+
 
 def validate_patch_data_mf(patch_data: dict) -> MarsSchemaMF:
     """
@@ -42,9 +50,16 @@ def validate_patch_data_zm(patch_data: dict) -> MarsSchemaZM:
 
 def patch(
     input_path: str | PathLike[str],
-    output_path: str | PathLike[str],
+    output_path: str | PathLike[str] | BinaryIO,
     patch_data: dict,
     status_update: Callable[[str, float], None],
+    base_patch_cache_dir: str | PathLike[str] | None = None,
+    output_format: OutputFormat = OutputFormat.ROM,
+    deduplicate_data: bool = False,
+    discover_free_space: bool = False,
+    expand_size: int | None = None,
+    compact_free_space: bool = False,
+    input_checksum: int | None = None,
 ) -> None:
     """
     Creates a new randomized GBA Metroid game, based off of an input path, an output path,
@@ -52,17 +67,157 @@ def patch(
 
     Args:
         input_path: The path to an unmodified GBA Metroid (U) ROM.
-        output_path: The path where the randomized GBA Metroid ROM should be saved to.
+        output_path: The path or binary file object where the randomized GBA Metroid ROM should
+            be saved to.
         patch_data: A dictionary defining how the game should be randomized.
         status_update: A function taking in a message (str) and a progress value (float).
+            A summary of the free space usage is also sent to it before saving.
+        base_patch_cache_dir: An optional directory where the base patched ROM and compressed
+            data are cached between runs. Entries are keyed by the checksums of their inputs
+            and the base patch or compressor version, so updates are picked up automatically.
+        output_format: Whether to save the full ROM, or a patch against the input ROM.
+        deduplicate_data: Whether identical data written to free space (such as repeated text)
+            should share a single copy.
+        discover_free_space: Whether unused padding in the ROM should be added to the free
+            space, in addition to the reserved free space.
+        expand_size: If provided, the ROM is expanded to this size (16 MB or 32 MB), and the
+            new space is used for data that doesn't fit in the reserved free space.
+        compact_free_space: Whether data written to free space should be packed together at
+            the end of patching, leaving one large free block.
+        input_checksum: The CRC32 of the input ROM, if it's already known. It's trusted without
+            being checked. Otherwise, if a base patch cache directory is provided, the checksum
+            of a previously verified input ROM is looked up there by the file's path, size,
+            modification time, and inode.
     """
 
+    # Look up the checksum of an input rom that was verified before
+    fingerprints = None
+    input_fingerprint = None
+    if input_checksum is None and base_patch_cache_dir is not None:
+        fingerprints = FingerprintCache(os.path.join(base_patch_cache_dir, FINGERPRINT_FILE))
+        input_fingerprint = file_fingerprint(input_path)
+        input_checksum = fingerprints.get(input_fingerprint)
+
     # Load input rom
-    rom = Rom(input_path)
+    rom = Rom(input_path, input_checksum)
+    patch_rom(
+        rom,
+        output_path,
+        patch_data,
+        status_update,
+        base_patch_cache_dir,
+        output_format,
+        deduplicate_data,
+        discover_free_space,
+        expand_size,
+        compact_free_space,
+    )
+    # The checksum is only known when it was verified against the base patch
+    if fingerprints is not None and input_checksum is None and rom.checksum is not None:
+        fingerprints.put(input_fingerprint, rom.checksum)
+
+
+def patch_bytes(
+    input_data: bytes | bytearray | memoryview,
+    patch_data: dict,
+    status_update: Callable[[str, float], None],
+    base_patch_cache_dir: str | PathLike[str] | None = None,
+    output_format: OutputFormat = OutputFormat.ROM,
+    deduplicate_data: bool = False,
+    discover_free_space: bool = False,
+    expand_size: int | None = None,
+    compact_free_space: bool = False,
+    input_checksum: int | None = None,
+) -> bytes:
+    """
+    Creates a new randomized GBA Metroid game from a ROM that is already in memory, and returns
+    the output instead of saving it. See patch() for a description of the arguments.
+
+    Args:
+        input_data: The data of an unmodified GBA Metroid (U) ROM. A bytearray is used without
+            copying and is modified by patching. Other buffers are copied first, since reading
+            a bytearray is faster than reading copy-on-write data, and they're never modified.
+    """
+    if not isinstance(input_data, bytearray):
+        input_data = bytearray(input_data)
+    rom = Rom.from_buffer(input_data, input_checksum)
+    output = io.BytesIO()
+    patch_rom(
+        rom,
+        output,
+        patch_data,
+        status_update,
+        base_patch_cache_dir,
+        output_format,
+        deduplicate_data,
+        discover_free_space,
+        expand_size,
+        compact_free_space,
+    )
+    return output.getvalue()
+
+
+def patch_rom(
+    rom: Rom,
+    output_path: str | PathLike[str] | BinaryIO,
+    patch_data: dict,
+    status_update: Callable[[str, float], None],
+    base_patch_cache_dir: str | PathLike[str] | None = None,
+    output_format: OutputFormat = OutputFormat.ROM,
+    deduplicate_data: bool = False,
+    discover_free_space: bool = False,
+    expand_size: int | None = None,
+    compact_free_space: bool = False,
+) -> None:
+    """
+    Creates a new randomized GBA Metroid game from a loaded ROM, such as one created from a
+    SharedRomImage in a worker process. See patch() for a description of the arguments.
+
+    Raises:
+        ValueError: If saving as a patch, and the base patch was already applied to the ROM
+            without keeping the original data, or if saving as an IPS patch and expanding the
+            ROM.
+    """
+    if output_format == OutputFormat.IPS and expand_size is not None:
+        raise ValueError("IPS patches can't change the size of the ROM, so it can't be expanded")
+    if output_format != OutputFormat.ROM:
+        if rom.base_patch_applied and rom.original_data is None:
+            # The patch would be created against the base patched data instead
+            raise ValueError("Original data must be kept to save a base patched ROM as a patch")
+        rom.keep_original_data()
+    if deduplicate_data:
+        rom.enable_deduplication()
+    # Rooms and minimaps are loaded by several steps, so only decompress each one once
+    rom.enable_asset_cache()
+
+    # Reuse data compressed on earlier runs
+    if base_patch_cache_dir is not None:
+        rom.compression_cache = CompressionCache(
+            os.path.join(base_patch_cache_dir, COMPRESSION_CACHE_DIR)
+        )
 
     if rom.is_mf():
-        patch_mf(rom, output_path, validate_patch_data_mf(patch_data), status_update)
+        patch_mf(
+            rom,
+            output_path,
+            validate_patch_data_mf(patch_data),
+            status_update,
+            base_patch_cache_dir,
+            output_format,
+            discover_free_space,
+            expand_size,
+            compact_free_space,
+        )
     elif rom.is_zm():
-        patch_zm(rom, output_path, validate_patch_data_zm(patch_data), status_update)
+        patch_zm(
+            rom,
+            output_path,
+            validate_patch_data_zm(patch_data),
+            status_update,
+            output_format,
+            discover_free_space,
+            expand_size,
+            compact_free_space,
+        )
     else:
         raise ValueError(rom)
@@ -1,7 +1,10 @@
+import re
+from collections.abc import Iterable
 from enum import Enum
+from typing import NoReturn
 from zlib import crc32
 
-from mars_patcher.common_types import BytesLike
+from mars_patcher.common_types import BytesLike, RomData
 
 
 class BpsDecodeError(Enum):
@@ -21,8 +24,26 @@ class BpsDecoder:
         raise ValueError(msg)
 
     def apply_patch(
-        self, patch: bytes, source: BytesLike, ignore_checksum: bool = False
+        self,
+        patch: bytes,
+        source: BytesLike,
+        ignore_checksum: bool = False,
+        source_checksum: int | None = None,
     ) -> bytearray:
+        """
+        Applies a BPS patch to the source and returns the target.
+
+        Args:
+            patch: The BPS patch.
+            source: The data to apply the patch to.
+            ignore_checksum: Whether to skip checking the source, target, and patch checksums.
+            source_checksum: The CRC32 of the source, if it's already known. The checksum of
+                the source is then not computed. The checksum of the target is still checked,
+                so a wrong source checksum is caught after the patch is applied.
+
+        Raises:
+            ValueError: If the patch is invalid, or does not apply to the source.
+        """
         self.patch = patch
         self.source = source
 
@@ -51,7 +72,10 @@ class BpsDecoder:
             if patch_checksum_expected != patch_checksum_actual:
                 self.error(BpsDecodeError.INVALID_BPS)
 
-            source_checksum_actual = crc32(self.source)
+            if source_checksum is None:
+                source_checksum_actual = crc32(self.source)
+            else:
+                source_checksum_actual = source_checksum
             if source_size != len(source) or source_checksum_expected != source_checksum_actual:
                 if (
                     len(source) == target_size
@@ -61,47 +85,65 @@ class BpsDecoder:
                 self.error(BpsDecodeError.INVALID_SOURCE)
 
         # Actions
+        # The target is preallocated and filled using slice copies, which is much faster than
+        # appending one byte at a time
         output_offset = 0
         source_offset = 0
         target_offset = 0
-        target = bytearray()
+        target = bytearray(target_size)
         while self.patch_idx < footer_start:
             num = self.decode_int()
             length = (num >> 2) + 1
-            if output_offset + length > target_size:
+            output_end = output_offset + length
+            if output_end > target_size:
                 self.error(BpsDecodeError.INVALID_BPS)
             action = num & 3
             if action == 0:
                 # Source read
-                for _ in range(length):
-                    target.append(source[output_offset])
-                    output_offset += 1
+                if output_end > len(source):
+                    self.error(BpsDecodeError.INVALID_BPS)
+                target[output_offset:output_end] = source[output_offset:output_end]
             elif action == 1:
                 # Target read
-                for _ in range(length):
-                    target.append(self.read_8())
-                    output_offset += 1
+                patch_end = self.patch_idx + length
+                if patch_end > footer_start:
+                    self.error(BpsDecodeError.INVALID_BPS)
+                target[output_offset:output_end] = self.patch[self.patch_idx : patch_end]
+                self.patch_idx = patch_end
             elif action == 2:
                 # Source copy
                 offset = self.decode_int()
                 source_offset += (-1 if offset & 1 else 1) * (offset >> 1)
-                for _ in range(length):
-                    target.append(source[source_offset])
-                    output_offset += 1
-                    source_offset += 1
+                source_end = source_offset + length
+                if source_offset < 0 or source_end > len(source):
+                    self.error(BpsDecodeError.INVALID_BPS)
+                target[output_offset:output_end] = source[source_offset:source_end]
+                source_offset = source_end
             elif action == 3:
                 # Target copy
                 offset = self.decode_int()
                 target_offset += (-1 if offset & 1 else 1) * (offset >> 1)
-                for _ in range(length):
-                    target.append(target[target_offset])
-                    output_offset += 1
-                    target_offset += 1
-        if self.patch_idx > footer_start:
+                if target_offset < 0 or target_offset >= output_offset:
+                    self.error(BpsDecodeError.INVALID_BPS)
+                target_end = target_offset + length
+                if target_end <= output_offset:
+                    target[output_offset:output_end] = target[target_offset:target_end]
+                else:
+                    # The copy overlaps the bytes it produces, which repeats the pattern
+                    # between the copy position and the output position
+                    pattern = target[target_offset:output_offset]
+                    repeats = length // len(pattern) + 1
+                    target[output_offset:output_end] = (pattern * repeats)[:length]
+                target_offset = target_end
+            output_offset = output_end
+        if self.patch_idx > footer_start or output_offset != target_size:
             self.error(BpsDecodeError.INVALID_BPS)
         if not ignore_checksum:
             target_checksum_actual = crc32(target)
             if target_checksum_expected != target_checksum_actual:
+                # A source checksum that was provided may not match the source
+                if source_checksum is not None:
+                    self.error(BpsDecodeError.INVALID_SOURCE)
                 self.error(BpsDecodeError.INVALID_BPS)
         return target
 
@@ -130,6 +172,148 @@ class BpsDecoder:
             num += shift
 
 
+DIFF_LARGE_BLOCK_SIZE = 0x1000
+DIFF_BLOCK_SIZE = 0x40
+"""Changes are located by comparing blocks of these sizes before comparing single bytes."""
+
+
+def find_changed_ranges(
+    source: BytesLike | RomData | memoryview,
+    target: BytesLike,
+    candidates: Iterable[tuple[int, int]] | None = None,
+    max_gap: int = 0,
+) -> list[tuple[int, int]]:
+    """
+    Returns the sorted (start, end) ranges where the target differs from the source. Bytes
+    past the end of the source always count as changed.
+
+    Args:
+        source: The original data.
+        target: The modified data.
+        candidates: Sorted, non-overlapping ranges that contain every change, such as the
+            dirty ranges of a WriteJournal. If None, the full target is compared.
+        max_gap: Changed ranges separated by at most this many unchanged bytes are merged.
+    """
+    target_size = len(target)
+    common_size = min(len(source), target_size)
+    if candidates is None:
+        candidates = [(0, target_size)]
+    elif target_size > common_size:
+        # Data past the end of the source is always changed
+        candidates = [*candidates, (common_size, target_size)]
+    ranges: list[tuple[int, int]] = []
+
+    def add_range(start: int, end: int) -> None:
+        if ranges and start - ranges[-1][1] <= max_gap:
+            ranges[-1] = (ranges[-1][0], max(end, ranges[-1][1]))
+        else:
+            ranges.append((start, end))
+
+    for cand_start, cand_end in candidates:
+        cand_end = min(cand_end, target_size)
+        # Compare in large blocks, then small blocks, and only compare single bytes within
+        # small blocks that differ
+        compare_end = min(cand_end, common_size)
+        for large in range(cand_start, compare_end, DIFF_LARGE_BLOCK_SIZE):
+            large_end = min(large + DIFF_LARGE_BLOCK_SIZE, compare_end)
+            if source[large:large_end] == target[large:large_end]:
+                continue
+            for block in range(large, large_end, DIFF_BLOCK_SIZE):
+                block_end = min(block + DIFF_BLOCK_SIZE, large_end)
+                if source[block:block_end] == target[block:block_end]:
+                    continue
+                change_start: int | None = None
+                for i in range(block, block_end):
+                    if source[i] != target[i]:
+                        if change_start is None:
+                            change_start = i
+                    elif change_start is not None:
+                        add_range(change_start, i)
+                        change_start = None
+                if change_start is not None:
+                    add_range(change_start, block_end)
+        if cand_end > common_size:
+            add_range(max(cand_start, common_size), cand_end)
+    return ranges
+
+
+class BpsEncoder:
+    MAX_GAP = 4
+    """Unchanged gaps up to this size are stored as part of the surrounding changes."""
+    MIN_RUN_SIZE = 8
+    """Runs of a single byte at least this long are stored as copies of the previous byte."""
+    RUN_PATTERN = re.compile(rb"(.)\1{%d,}" % (MIN_RUN_SIZE - 1), re.DOTALL)
+
+    def create_patch(
+        self,
+        source: BytesLike | memoryview,
+        target: BytesLike,
+        dirty_ranges: Iterable[tuple[int, int]] | None = None,
+    ) -> bytes:
+        """
+        Creates a BPS patch that turns the source into the target. Unchanged data is read from
+        the source, changed data is stored in the patch, and runs of a single byte are encoded
+        as overlapping target copies. If dirty ranges are provided, only those ranges are
+        compared, which makes encoding proportional to the size of the changes.
+        """
+        self.output = bytearray(b"BPS1")
+        self.encode_int(len(source))
+        self.encode_int(len(target))
+        # No metadata
+        self.encode_int(0)
+
+        output_offset = 0
+        self.target_offset = 0
+        for start, end in find_changed_ranges(source, target, dirty_ranges, self.MAX_GAP):
+            if start > output_offset:
+                self.encode_action(0, start - output_offset)
+            self.encode_changes(target, start, end)
+            output_offset = end
+        if output_offset < len(target):
+            self.encode_action(0, len(target) - output_offset)
+
+        # Footer
+        self.output += crc32(source).to_bytes(4, "little")
+        self.output += crc32(target).to_bytes(4, "little")
+        self.output += crc32(self.output).to_bytes(4, "little")
+        return bytes(self.output)
+
+    def encode_changes(self, target: BytesLike, start: int, end: int) -> None:
+        data = target[start:end]
+        literal_start = 0
+        for match in self.RUN_PATTERN.finditer(data):
+            run_start, run_end = match.span()
+            # Store the first byte of the run, then copy it from one byte behind
+            self.encode_target_read(data, literal_start, run_start + 1)
+            copy_addr = start + run_start
+            self.encode_action(3, run_end - run_start - 1)
+            self.encode_signed_int(copy_addr - self.target_offset)
+            self.target_offset = start + run_end - 1
+            literal_start = run_end
+        self.encode_target_read(data, literal_start, len(data))
+
+    def encode_target_read(self, data: BytesLike, start: int, end: int) -> None:
+        if end > start:
+            self.encode_action(1, end - start)
+            self.output += data[start:end]
+
+    def encode_action(self, action: int, length: int) -> None:
+        self.encode_int(((length - 1) << 2) | action)
+
+    def encode_signed_int(self, num: int) -> None:
+        self.encode_int((abs(num) << 1) | (1 if num < 0 else 0))
+
+    def encode_int(self, num: int) -> None:
+        while True:
+            x = num & 0x7F
+            num >>= 7
+            if num == 0:
+                self.output.append(0x80 | x)
+                return
+            self.output.append(x)
+            num -= 1
+
+
 class IpsDecodeError(Enum):
     INVALID_IPS = 0
     ABRUPT_IPS_END = 1
@@ -138,7 +322,7 @@ class IpsDecodeError(Enum):
 
 
 class IpsDecoder:
-    def error(self, err: IpsDecodeError, extra: str | None = None) -> None:
+    def error(self, err: IpsDecodeError, extra: str | None = None) -> NoReturn:
         if err == IpsDecodeError.INVALID_IPS:
             msg = "Invalid IPS file"
         elif err == IpsDecodeError.ABRUPT_IPS_END:
@@ -151,7 +335,20 @@ class IpsDecoder:
             msg += ", " + extra
         raise ValueError(msg)
 
-    def apply_patch(self, patch: bytes, target: bytearray) -> None:
+    def apply_patch(self, patch: bytes, target: RomData) -> None:
+        """Applies a patch to the target."""
+        for addr, vals in self.read_records(patch, len(target)):
+            target[addr : addr + len(vals)] = vals
+
+    def read_records(self, patch: bytes, target_size: int) -> list[tuple[int, bytes]]:
+        """
+        Returns the address and bytes of each record in a patch, so they can be written
+        separately. The whole patch is checked first, so an invalid patch writes nothing.
+
+        Raises:
+            ValueError: If the patch is invalid, or writes past the end of the target.
+        """
+        records: list[tuple[int, bytes]] = []
         # Check signature
         patch_len = len(patch)
         if patch_len < 8 or patch[:5] != b"PATCH":
@@ -162,7 +359,7 @@ class IpsDecoder:
         while idx + 2 < patch_len:
             # Check EOF
             if patch[idx : idx + 3] == b"EOF":
-                return
+                return records
 
             # Get address and size
             addr = (patch[idx] << 16) | (patch[idx + 1] << 8) | patch[idx + 2]
@@ -177,23 +374,97 @@ class IpsDecoder:
                 if idx + 1 >= patch_len:
                     self.error(IpsDecodeError.ABRUPT_IPS_END, "entry cut off before RLE size")
                 rle_size = (patch[idx] << 8) | patch[idx + 1]
-                if addr + rle_size > len(target):
+                if addr + rle_size > target_size:
                     self.error(IpsDecodeError.PAST_TARGET_END)
                 idx += 2
                 if idx >= patch_len:
                     self.error(IpsDecodeError.ABRUPT_IPS_END, "entry cut off before RLE byte")
                 rle_byte = patch[idx]
                 idx += 1
-                for i in range(addr, addr + rle_size):
-                    target[i] = rle_byte
+                records.append((addr, bytes([rle_byte]) * rle_size))
             else:
                 if idx + size > patch_len:
                     self.error(
                         IpsDecodeError.ABRUPT_IPS_END, "entry cut off before end of data block"
                     )
-                if addr + size > len(target):
+                if addr + size > target_size:
                     self.error(IpsDecodeError.PAST_TARGET_END)
-                target[addr : addr + size] = patch[idx : idx + size]
+                records.append((addr, patch[idx : idx + size]))
                 idx += size
 
         self.error(IpsDecodeError.MISSING_EOF)
+
+
+class IpsEncoder:
+    MAX_ADDR = 0xFFFFFF
+    """The largest address that an IPS record can start at."""
+    EOF_ADDR = 0x454F46
+    """Records can't start at this address, since it reads as the EOF marker."""
+    MAX_RECORD_SIZE = 0xFFFF
+    MAX_GAP = 5
+    """Unchanged gaps up to this size are stored as part of the surrounding changes."""
+    MIN_RUN_SIZE = 16
+    """Runs of a single byte at least this long are stored as RLE records."""
+    RUN_PATTERN = re.compile(rb"(.)\1{%d,}" % (MIN_RUN_SIZE - 1), re.DOTALL)
+
+    def create_patch(
+        self,
+        source: BytesLike | memoryview,
+        target: BytesLike,
+        dirty_ranges: Iterable[tuple[int, int]] | None = None,
+    ) -> bytes:
+        """
+        Creates an IPS patch that turns the source into the target, containing only the changed
+        bytes. Runs of a single byte are stored as RLE records. If dirty ranges are provided,
+        only those ranges are compared.
+
+        Raises:
+            ValueError: If the source and target have different sizes, or a change is past the
+                        largest address IPS supports.
+        """
+        if len(source) != len(target):
+            raise ValueError("IPS patches can't change the size of the data")
+        self.target = target
+        self.output = bytearray(b"PATCH")
+        for start, end in find_changed_ranges(source, target, dirty_ranges, self.MAX_GAP):
+            data = target[start:end]
+            literal_start = 0
+            for match in self.RUN_PATTERN.finditer(data):
+                run_start, run_end = match.span()
+                self.add_records(start + literal_start, start + run_start)
+                self.add_rle_records(start + run_start, start + run_end)
+                literal_start = run_end
+            self.add_records(start + literal_start, end)
+        self.output += b"EOF"
+        return bytes(self.output)
+
+    def add_records(self, start: int, end: int) -> None:
+        # Leave room for one extra byte in case a record needs to start earlier
+        for addr in range(start, end, self.MAX_RECORD_SIZE - 1):
+            record_end = min(addr + self.MAX_RECORD_SIZE - 1, end)
+            if addr == self.EOF_ADDR:
+                addr -= 1
+            self.write_header(addr, record_end - addr)
+            self.output += self.target[addr:record_end]
+
+    def add_rle_records(self, start: int, end: int) -> None:
+        if start == self.EOF_ADDR:
+            # Write the first byte along with the one before it instead
+            self.add_records(start, start + 1)
+            start += 1
+        val = self.target[start]
+        for addr in range(start, end, self.MAX_RECORD_SIZE):
+            size = min(self.MAX_RECORD_SIZE, end - addr)
+            if size < 3 or addr == self.EOF_ADDR:
+                # Too short to be worth an RLE record, or at an address a record can't start at
+                self.add_records(addr, addr + size)
+                continue
+            self.write_header(addr, 0)
+            self.output += size.to_bytes(2, "big")
+            self.output.append(val)
+
+    def write_header(self, addr: int, size: int) -> None:
+        if addr > self.MAX_ADDR:
+            raise ValueError(f"Address 0x{addr:X} is too large for an IPS patch")
+        self.output += addr.to_bytes(3, "big")
+        self.output += size.to_bytes(2, "big")
@@ -0,0 +1,128 @@
+import re
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from collections.abc import Collection, Iterable
+
+from mars_patcher.common_types import BytesLike
+
+
+def _byte_mask(data: BytesLike, values: set[int]) -> int:
+    # Returns an integer with 0xFF for each byte of the data in values, and 0 for the others
+    table = bytes(0xFF if i in values else 0 for i in range(256))
+    return int.from_bytes(data.translate(table), "little")
+
+
+class PointerIndex:
+    """
+    A reverse index from ROM addresses to the 4-byte aligned locations that contain pointers to
+    them. The index is built with one scan of the ROM, and words written afterwards are added to it
+    with add_words(). Since any word in the ROM range is treated as a pointer, and the data can
+    change after the scan, locations should be verified against the current data before use.
+    """
+
+    def __init__(
+        self, data: BytesLike, rom_offset: int, targets: Collection[int] | None = None
+    ) -> None:
+        """
+        Scans the data for pointers. If targets are provided, only pointers to those addresses
+        are found by the scan, which only checks the words whose upper two bytes match a target.
+        """
+        self.rom_offset = rom_offset
+        self._rom_end = rom_offset + len(data)
+        self._base = self._scan(data, rom_offset, targets)
+        # Pointers added after the scan. Kept separately so forks can share the scanned index
+        self._added: dict[int, set[int]] = {}
+        self._sorted_targets: list[int] | None = None
+
+    @staticmethod
+    def _scan(
+        data: BytesLike, rom_offset: int, targets: Collection[int] | None
+    ) -> dict[int, list[int]]:
+        size = len(data) & ~3
+        words = array("I", data[:size])
+        if sys.byteorder == "big":
+            words.byteswap()
+        rom_end = rom_offset + len(data)
+        indexes: Iterable[int]
+        if targets is None:
+            # Pointers are found by their most significant byte, which is every 4th byte
+            high_bytes = data[3:size:4]
+            indexes = [
+                m.start()
+                for high in range(rom_offset >> 24, ((rom_end - 1) >> 24) + 1)
+                for m in re.finditer(re.escape(bytes([high])), high_bytes)
+            ]
+            wanted: Collection[int] = range(rom_end - rom_offset)
+        else:
+            # Only words whose two most significant bytes could belong to a target are checked
+            ptrs = [addr + rom_offset for addr in targets]
+            mask = _byte_mask(data[3:size:4], {ptr >> 24 for ptr in ptrs})
+            mask &= _byte_mask(data[2:size:4], {(ptr >> 16) & 0xFF for ptr in ptrs})
+            matches = mask.to_bytes(size // 4, "little")
+            indexes = [m.start() for m in re.finditer(b"[^\\x00]", matches)]
+            wanted = set(targets)
+        found: dict[int, list[int]] = {}
+        for idx in indexes:
+            addr = words[idx] - rom_offset
+            if addr in wanted:
+                locs = found.get(addr)
+                if locs is None:
+                    found[addr] = [idx * 4]
+                else:
+                    locs.append(idx * 4)
+        return found
+
+    def candidates(self, addr: int) -> list[int]:
+        """Returns the sorted locations that have pointed to an address, without verifying them."""
+        locs = set(self._base.get(addr, ()))
+        locs.update(self._added.get(addr, ()))
+        return sorted(locs)
+
+    def add(self, location: int, addr: int) -> None:
+        """Records a pointer to an address that was written at a location."""
+        self._added.setdefault(addr, set()).add(location)
+
+    def add_words(self, location: int, data: BytesLike) -> None:
+        """
+        Records every word in data that points within the ROM, where data was written at a
+        4-byte aligned location.
+        """
+        size = len(data) & ~3
+        for i, (val,) in enumerate(struct.iter_unpack("<I", data[:size])):
+            if self.rom_offset <= val < self._rom_end:
+                self.add(location + i * 4, val - self.rom_offset)
+
+    def has_targets_in(self, start: int, end: int) -> bool:
+        """Returns true if any scanned pointer points within [start, end)."""
+        targets = self._get_sorted_targets()
+        i = bisect_left(targets, start)
+        if i < len(targets) and targets[i] < end:
+            return True
+        return any(start <= addr < end for addr in self._added)
+
+    def nearest_target_before(self, addr: int) -> int | None:
+        """Returns the highest address below addr that any pointer points to, if any."""
+        targets = self._get_sorted_targets()
+        i = bisect_left(targets, addr)
+        nearest = targets[i - 1] if i > 0 else None
+        for target in self._added:
+            if target < addr and (nearest is None or target > nearest):
+                nearest = target
+        return nearest
+
+    def _get_sorted_targets(self) -> list[int]:
+        if self._sorted_targets is None:
+            self._sorted_targets = sorted(self._base)
+        return self._sorted_targets
+
+    def fork(self) -> "PointerIndex":
+        """Returns a copy of the index that shares the scanned pointers."""
+        other = PointerIndex.__new__(PointerIndex)
+        other.rom_offset = self.rom_offset
+        other._rom_end = self._rom_end
+        other._base = self._base
+        other._sorted_targets = self._sorted_targets
+        other._added = {addr: set(locs) for addr, locs in self._added.items()}
+        return other
@@ -0,0 +1,89 @@
+from bisect import bisect_left, bisect_right
+from collections.abc import Iterator
+
+
+class RangeSet:
+    """
+    A set of addresses stored as sorted half-open ranges. Overlapping and adjacent ranges are
+    always merged, so each range is as large as possible.
+    """
+
+    def __init__(self) -> None:
+        self._starts: list[int] = []
+        self._ends: list[int] = []
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    def __iter__(self) -> Iterator[tuple[int, int]]:
+        return zip(self._starts, self._ends)
+
+    def add(self, start: int, end: int) -> None:
+        """Adds the range [start, end), merging it with any ranges it touches."""
+        if start >= end:
+            return
+        starts = self._starts
+        ends = self._ends
+        # Fast path for ranges past the end, which is the common case for sequential writes
+        if not ends or start > ends[-1]:
+            starts.append(start)
+            ends.append(end)
+            return
+        # Ranges i to j-1 overlap or are adjacent to the new range
+        i = bisect_left(ends, start)
+        j = bisect_right(starts, end)
+        if i < j:
+            start = min(start, starts[i])
+            end = max(end, ends[j - 1])
+        starts[i:j] = [start]
+        ends[i:j] = [end]
+
+    def remove(self, start: int, end: int) -> None:
+        """Removes the range [start, end), splitting any range that contains it."""
+        if start >= end:
+            return
+        starts = self._starts
+        ends = self._ends
+        # Ranges i to j-1 overlap the removed range
+        i = bisect_right(ends, start)
+        j = bisect_left(starts, end)
+        if i >= j:
+            return
+        new_starts = []
+        new_ends = []
+        if starts[i] < start:
+            new_starts.append(starts[i])
+            new_ends.append(start)
+        if ends[j - 1] > end:
+            new_starts.append(end)
+            new_ends.append(ends[j - 1])
+        starts[i:j] = new_starts
+        ends[i:j] = new_ends
+
+    def overlaps(self, start: int, end: int) -> bool:
+        """Returns true if any address in [start, end) is in the set."""
+        i = bisect_right(self._ends, start)
+        return i < len(self._starts) and self._starts[i] < end
+
+    def touching(self, start: int, end: int) -> list[tuple[int, int]]:
+        """Returns the ranges that overlap or are adjacent to [start, end)."""
+        i = bisect_left(self._ends, start)
+        j = bisect_right(self._starts, end)
+        return list(zip(self._starts[i:j], self._ends[i:j]))
+
+    def range_containing(self, addr: int) -> tuple[int, int] | None:
+        """Returns the range that contains the address, or None if it's not in the set."""
+        i = bisect_right(self._ends, addr)
+        if i < len(self._starts) and self._starts[i] <= addr:
+            return self._starts[i], self._ends[i]
+        return None
+
+    def total_size(self) -> int:
+        """Returns the number of addresses in the set."""
+        return sum(self._ends) - sum(self._starts)
+
+    def copy(self) -> "RangeSet":
+        other = RangeSet()
+        other._starts = self._starts.copy()
+        other._ends = self._ends.copy()
+        return other
@@ -0,0 +1,64 @@
+import struct
+from collections.abc import Callable, Iterator
+from itertools import starmap
+from typing import Generic, TypeVar
+
+from mars_patcher.common_types import RomData
+from mars_patcher.cow_buffer import CowBuffer
+
+T = TypeVar("T", bound=tuple)
+
+
+class RecordLayout(Generic[T]):
+    """
+    The layout of a fixed size record in ROM data, such as a door entry or a tileset entry.
+    Records are decoded with a precompiled little endian struct.Struct into a record type,
+    which is usually a NamedTuple with one field for each value in the format. Every byte of
+    a record should belong to a field, so writing a record back never changes bytes that
+    weren't modified.
+
+    Reads from bytearrays and memoryviews use the data directly without copying it, while
+    CowBuffers are copied one slice at a time.
+    """
+
+    def __init__(self, record_type: Callable[..., T], fmt: str):
+        self.struct = struct.Struct("<" + fmt)
+        self.size = self.struct.size
+        self.record_type = record_type
+
+    def unpack(self, vals: bytes | bytearray | memoryview) -> T:
+        """Decodes a record from the start of a bytes like object."""
+        return self.record_type(*self.struct.unpack_from(vals))
+
+    def pack(self, record: T) -> bytes:
+        """Encodes a record as bytes."""
+        return self.struct.pack(*record)
+
+    def read(self, data: RomData | memoryview, addr: int) -> T:
+        """Reads the record at an address."""
+        if isinstance(data, CowBuffer):
+            return self.record_type(*self.struct.unpack(data[addr : addr + self.size]))
+        return self.record_type(*self.struct.unpack_from(data, addr))
+
+    def iter_read(self, data: RomData | memoryview, addr: int, count: int) -> Iterator[T]:
+        """
+        Lazily reads an array of records starting at an address. For bytearrays, each record is
+        read when it's reached, so writes made while iterating are seen by later records.
+        """
+        end = addr + count * self.size
+        if isinstance(data, CowBuffer):
+            view: bytearray | memoryview = data[addr:end]
+        else:
+            view = memoryview(data)[addr:end]
+        return starmap(self.record_type, self.struct.iter_unpack(view))
+
+    def read_array(self, data: RomData | memoryview, addr: int, count: int) -> list[T]:
+        """Reads an array of records starting at an address."""
+        return list(self.iter_read(data, addr, count))
+
+    def write(self, data: RomData, addr: int, record: T) -> None:
+        """Writes a record to an address."""
+        if isinstance(data, CowBuffer):
+            data[addr : addr + self.size] = self.struct.pack(*record)
+        else:
+            self.struct.pack_into(data, addr, *record)
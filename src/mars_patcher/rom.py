@@ -1,14 +1,48 @@
-from collections.abc import Sequence
+import copy
+import mmap
+import struct
+import sys
+from array import array
+from collections.abc import Callable, Iterator, Sequence
+from contextlib import contextmanager
 from enum import Enum
 from os import PathLike
+from types import TracebackType
+from typing import TYPE_CHECKING, BinaryIO, Literal, NamedTuple, TypeVar
 
-from mars_patcher.common_types import BytesLike
+from mars_patcher.asset_cache import AssetCache
+from mars_patcher.common_types import BytesLike, RomData
+from mars_patcher.compress import decomp_lz77, decomp_rle
+from mars_patcher.cow_buffer import CowBuffer
+from mars_patcher.dedup import DedupIndex
+from mars_patcher.free_space import (
+    PADDING_GUARD_SIZE,
+    PADDING_MIN_SIZE,
+    Allocation,
+    FreeSpaceAllocator,
+    align,
+    find_padding,
+)
 from mars_patcher.mf.constants.reserved_space import ReservedConstantsMF
+from mars_patcher.patching import BpsEncoder, IpsEncoder, find_changed_ranges
+from mars_patcher.pointer_index import PointerIndex
+from mars_patcher.record_view import RecordLayout
+from mars_patcher.write_journal import WriteJournal
 from mars_patcher.zm.constants.reserved_space import ReservedConstantsZM
 
+if TYPE_CHECKING:
+    from mars_patcher.compression_cache import CompressionCache
+
 SIZE_8MB = 0x800000
+SIZE_16MB = 0x1000000
+SIZE_32MB = 0x2000000
 ROM_OFFSET = 0x8000000
 
+T = TypeVar("T", bound=tuple)
+
+_U16 = struct.Struct("<H")
+_U32 = struct.Struct("<I")
+
 
 class Game(Enum):
     """The possible GBA games."""
@@ -32,6 +66,104 @@ class Region(Enum):
     """Chinese"""
 
 
+class OutputFormat(Enum):
+    """The possible formats for saving a ROM."""
+
+    ROM = 1
+    """The full ROM"""
+    BPS = 2
+    """A BPS patch against the original ROM"""
+    IPS = 3
+    """An IPS patch against the original ROM"""
+
+
+def _copy_allocations(allocations: dict[int, Allocation]) -> dict[int, Allocation]:
+    return {addr: Allocation(a.size, a.pointers.copy()) for addr, a in allocations.items()}
+
+
+class _FreeSpaceState(NamedTuple):
+    """Copies of the free space state of a ROM, saved by a Transaction."""
+
+    allocator: FreeSpaceAllocator
+    allocations: dict[int, Allocation]
+    dedup: DedupIndex | None
+
+    @classmethod
+    def save(cls, rom: "Rom") -> "_FreeSpaceState":
+        dedup = None if rom.dedup is None else rom.dedup.copy()
+        return cls(rom.allocator.copy(), _copy_allocations(rom.allocations), dedup)
+
+    def restore(self, rom: "Rom") -> None:
+        # Copied again, so the state can be restored more than once
+        rom.allocator = self.allocator.copy()
+        rom.allocations = _copy_allocations(self.allocations)
+        rom.dedup = None if self.dedup is None else self.dedup.copy()
+
+
+class Transaction:
+    """
+    A checkpoint of a ROM, created by Rom.transaction(). While it's active, the bytes that are
+    overwritten are saved before each write, so rolling back only takes time proportional to
+    the number of bytes written. The free space state is saved the first time a Rom method
+    changes it, and the data is saved the first time it's replaced, such as when the ROM is
+    expanded.
+    """
+
+    def __init__(self, rom: "Rom"):
+        self.rom = rom
+        self._data = rom.data
+        # The data written to, the address, and the bytes that were overwritten
+        self._writes: list[tuple[RomData, int, bytes]] = []
+        # The free space state from before it first changed
+        self._free_space: _FreeSpaceState | None = None
+        # The number of writes made before the data was first replaced, and the data it had
+        self._replaced: tuple[int, bytes] | None = None
+
+    def record(self, data: RomData, addr: int, size: int) -> None:
+        """Saves the bytes that are about to be overwritten."""
+        self._writes.append((data, addr, bytes(data[addr : addr + size])))
+
+    def record_replace(self, data: RomData) -> None:
+        """Saves the data that is about to be replaced, if it wasn't replaced before."""
+        if self._replaced is None:
+            self._replaced = (len(self._writes), bytes(data))
+
+    def rollback(self) -> None:
+        """
+        Undoes all changes made to the ROM's data and free space since the checkpoint was made.
+        The transaction stays active, so it can be rolled back again later.
+        """
+        rom = self.rom
+        writes = self._writes
+        if self._replaced is not None:
+            # Writes made after the data was replaced went to buffers that are discarded. The
+            # replaced data is restored from the snapshot in case it was changed afterwards,
+            # then the writes made before it was replaced are undone
+            count, replaced = self._replaced
+            for start, end in find_changed_ranges(self._data, replaced):
+                self._data[start:end] = replaced[start:end]
+            writes = writes[:count]
+        for data, addr, old in reversed(writes):
+            data[addr : addr + len(old)] = old
+            if rom.asset_cache is not None:
+                rom.asset_cache.invalidate(addr, len(old))
+        if rom.data is not self._data:
+            if rom.asset_cache is not None:
+                rom.asset_cache.clear()
+            rom.pointer_index = None
+        rom.data = self._data
+        self._writes.clear()
+        self._replaced = None
+        if self._free_space is not None:
+            self._free_space.restore(rom)
+
+    def _merge_into(self, parent: "Transaction") -> None:
+        if self._replaced is not None and parent._replaced is None:
+            count, replaced = self._replaced
+            parent._replaced = (len(parent._writes) + count, replaced)
+        parent._writes.extend(self._writes)
+
+
 class Rom:
     """
     A class dealing with ROM operations, like loading and saving the ROM, or
@@ -40,9 +172,27 @@ class Rom:
     Attributes:
         game: An enum indicating the current game that is loaded.
         region: An enum indicating the region of the currently loaded game.
-        data: A bytearray containing the data from a loaded game.
-        free_space_addr: An integer keeping track of the current known address where free space in
-                         the game is contained.
+        data: A bytearray containing the data from a loaded game. For forked ROMs, and ROMs
+              created from other buffers, this is a CowBuffer that shares unmodified pages with
+              the ROM it was forked from or the buffer.
+        allocator: A FreeSpaceAllocator tracking the reserved free space, and all space freed when
+                   data is repointed.
+        allocations: The data written to free space whose pointers are known, keyed by address.
+                     This data can be moved by compact_free_space.
+        journal: An optional WriteJournal that records every write made to the data.
+        dedup: An optional DedupIndex. When enabled, data written with write_data_with_pointers
+               that is identical to data written before reuses the existing copy.
+        pointer_index: An optional PointerIndex for finding the pointers to an address. It's
+                       built the first time pointers are looked up.
+        asset_cache: An optional AssetCache of decompressed data, used by read_lz77 and
+                     read_rle.
+        compression_cache: An optional CompressionCache of data compressed on earlier runs,
+                           used when rooms, tilemaps, and graphics are compressed.
+        original_data: An optional copy of the data as it was loaded, which patches are created
+                       against.
+        base_patch_applied: Whether the base asm patch has already been applied to the data.
+        checksum: The CRC32 of the data as it was loaded, if it's known. It's trusted without
+                  being checked, and is not updated when the data changes.
     """
 
     _title_to_game = {
@@ -82,10 +232,67 @@ class Rom:
         },
     }
 
-    def __init__(self, path: str | PathLike[str]):
+    def __init__(self, path: str | PathLike[str], checksum: int | None = None):
         # Read file
         with open(path, "rb") as f:
-            self.data = bytearray(f.read())
+            data = bytearray(f.read())
+        self._load(data, checksum)
+
+    @classmethod
+    def from_buffer(
+        cls, data: bytes | bytearray | memoryview | mmap.mmap, checksum: int | None = None
+    ) -> "Rom":
+        """
+        Creates a ROM from data that is already in memory, without copying it. A bytearray is
+        used directly, so patching modifies it. Any other buffer is never modified; it's shared
+        copy-on-write like a forked ROM, so only the 4 KB pages that are written to are copied.
+
+        Raises:
+            ValueError: If the data is not a valid ROM.
+        """
+        rom = cls.__new__(cls)
+        if isinstance(data, bytearray):
+            rom._load(data, checksum)
+        else:
+            view = memoryview(data)
+            if view.format != "B" or view.ndim != 1:
+                view = view.cast("B")
+            cow = CowBuffer(view)
+            try:
+                rom._load(cow, checksum)
+            except BaseException:
+                # Release the data, so a memory mapped file can still be closed
+                cow.release()
+                view.release()
+                raise
+        return rom
+
+    @classmethod
+    def from_mmap(cls, path: str | PathLike[str], checksum: int | None = None) -> "Rom":
+        """
+        Creates a ROM by memory mapping a file as read-only, so the file is only read as it's
+        used and is never modified. The file should not be changed while the ROM is in use.
+        The ROM owns the mapping, which is closed by close() or by using the ROM as a context
+        manager.
+
+        Raises:
+            ValueError: If the file is not a valid ROM.
+        """
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            rom = cls.from_buffer(mapped, checksum)
+        except BaseException:
+            mapped.close()
+            raise
+        rom._mmap = mapped
+        return rom
+
+    def _load(self, data: RomData, checksum: int | None) -> None:
+        self.data = data
+        # The memory mapped file the data was loaded from, if it's owned by this ROM
+        self._mmap: mmap.mmap | None = None
+        self.checksum = checksum
         # Check length
         if len(self.data) != SIZE_8MB:
             raise ValueError("ROM should be 8MB")
@@ -104,13 +311,44 @@ class Rom:
         # For now we only allow (U) version
         if self.region != Region.U:
             raise ValueError("Only compatible with the North American (U) version")
-        # Set free space address
+        # Set reserved free space
         if self.is_mf():
-            self.free_space_addr = ReservedConstantsMF.PATCHER_FREE_SPACE_ADDR
+            self.free_space_start = ReservedConstantsMF.PATCHER_FREE_SPACE_ADDR
+            self.free_space_end = ReservedConstantsMF.PATCHER_FREE_SPACE_END
         elif self.is_zm():
-            self.free_space_addr = ReservedConstantsZM.PATCHER_FREE_SPACE_ADDR
-        # Track all spaces freed when data is repointed. Keys are addresses, values are sizes
-        self.free_spaces: dict[int, int] = {}
+            self.free_space_start = ReservedConstantsZM.PATCHER_FREE_SPACE_ADDR
+            self.free_space_end = ReservedConstantsZM.PATCHER_FREE_SPACE_END
+        # Track the reserved free space, and all spaces freed when data is repointed
+        self.allocator = FreeSpaceAllocator()
+        self.allocator.free(self.free_space_start, self.free_space_end - self.free_space_start)
+        self.allocations: dict[int, Allocation] = {}
+        self.journal: WriteJournal | None = None
+        self.dedup: DedupIndex | None = None
+        self.pointer_index: PointerIndex | None = None
+        self.asset_cache: AssetCache | None = None
+        self.compression_cache: CompressionCache | None = None
+        self.original_data: bytes | memoryview | None = None
+        self.base_patch_applied = False
+        # Active transactions, innermost last
+        self._transactions: list[Transaction] = []
+
+    @property
+    def data(self) -> RomData:
+        return self._data
+
+    @data.setter
+    def data(self, data: RomData) -> None:
+        self._data = data
+        # The data if it can be indexed directly, or None if reads go through the CowBuffer.
+        # A CowBuffer's base is read directly until the first write
+        self._view: bytearray | memoryview | None
+        if isinstance(data, bytearray):
+            self._view = data
+        else:
+            self._view = data.unmodified_view()
+            self._cow = data
+        # A snapshot of the data shared by forks, taken by the first fork after a write
+        self._fork_base: bytes | None = None
 
     def is_mf(self) -> bool:
         """Returns true when the currently loaded game is Metroid Fusion."""
@@ -122,20 +360,26 @@ class Rom:
 
     def read_8(self, addr: int) -> int:
         """Reads one byte from the specified address, and returns the read value."""
-        return self.data[addr]
+        view = self._view
+        if view is None:
+            return self._cow.read_u8(addr)
+        return view[addr]
 
     def read_16(self, addr: int) -> int:
         """Reads two bytes from the specified address, and returns the read value."""
-        return self.data[addr] | (self.data[addr + 1] << 8)
+        view = self._view
+        if view is None:
+            return self._cow.read_u16(addr)
+        val: int = _U16.unpack_from(view, addr)[0]
+        return val
 
     def read_32(self, addr: int) -> int:
         """Reads four bytes from the specified address, and returns the read value."""
-        return (
-            self.data[addr]
-            | (self.data[addr + 1] << 8)
-            | (self.data[addr + 2] << 16)
-            | (self.data[addr + 3] << 24)
-        )
+        view = self._view
+        if view is None:
+            return self._cow.read_u32(addr)
+        val: int = _U32.unpack_from(view, addr)[0]
+        return val
 
     def read_ptr(self, addr: int) -> int:
         """
@@ -167,23 +411,99 @@ class Rom:
         """
         return self.read_bytes(addr, size).decode("ascii")
 
+    def read_u16_array(self, addr: int, count: int) -> list[int]:
+        """Reads a specified amount of 16-bit integers from an address."""
+        return self._read_array("H", addr, count)
+
+    def read_u32_array(self, addr: int, count: int) -> list[int]:
+        """Reads a specified amount of 32-bit integers from an address."""
+        return self._read_array("I", addr, count)
+
+    def _read_array(self, typecode: Literal["H", "I"], addr: int, count: int) -> list[int]:
+        end = addr + count * array(typecode).itemsize
+        # Data that can be read directly is cast in place, while CowBuffers need their pages
+        # combined first
+        if self._view is not None:
+            view = memoryview(self._view)[addr:end].cast(typecode)
+        else:
+            view = memoryview(self.data[addr:end]).cast(typecode)
+        if sys.byteorder == "little":
+            return view.tolist()
+        vals = array(typecode, view)
+        vals.byteswap()
+        return vals.tolist()
+
+    def read_record(self, layout: RecordLayout[T], addr: int) -> T:
+        """Reads a record with the specified layout from an address."""
+        return layout.read(self._readable(), addr)
+
+    def read_records(self, layout: RecordLayout[T], addr: int, count: int) -> list[T]:
+        """Reads an array of records with the specified layout, starting at an address."""
+        return layout.read_array(self._readable(), addr, count)
+
+    def iter_records(self, layout: RecordLayout[T], addr: int, count: int) -> Iterator[T]:
+        """
+        Lazily reads an array of records with the specified layout, starting at an address.
+        Useful for arrays that end with a terminating record, where count is the maximum length.
+        """
+        return layout.iter_read(self._readable(), addr, count)
+
+    def _readable(self) -> RomData | memoryview:
+        # The data, or a view of it that's faster to read
+        return self.data if self._view is None else self._view
+
+    def read_lz77(self, addr: int) -> tuple[bytearray, int]:
+        """
+        Decompresses the LZ77 data at an address, and returns it with the size of the
+        compressed data. Uses the asset cache if one is enabled.
+        """
+        return self._read_compressed("lz77", decomp_lz77, addr)
+
+    def read_rle(self, addr: int) -> tuple[bytearray, int]:
+        """
+        Decompresses the RLE data at an address, and returns it with the size of the
+        compressed data. Uses the asset cache if one is enabled.
+        """
+        return self._read_compressed("rle", decomp_rle, addr)
+
+    def _read_compressed(
+        self,
+        kind: str,
+        decompress: Callable[[RomData | memoryview, int], tuple[bytearray, int]],
+        addr: int,
+    ) -> tuple[bytearray, int]:
+        if self.asset_cache is None:
+            return decompress(self._readable(), addr)
+        cached = self.asset_cache.get(kind, addr)
+        if cached is not None:
+            return cached
+        data, comp_size = decompress(self._readable(), addr)
+        self.asset_cache.put(kind, addr, data, comp_size)
+        return data, comp_size
+
     def write_8(self, addr: int, val: int) -> None:
         """Writes a number as a byte to a specified address."""
+        self._before_write(addr, 1)
         self.data[addr] = val & 0xFF
+        self._after_write(addr, 1)
 
     def write_16(self, addr: int, val: int) -> None:
         """Writes a number as two bytes (short) to a specified address."""
         val &= 0xFFFF
+        self._before_write(addr, 2)
         self.data[addr] = val & 0xFF
         self.data[addr + 1] = val >> 8
+        self._after_write(addr, 2)
 
     def write_32(self, addr: int, val: int) -> None:
         """Writes a number as four bytes (int) to a specified address."""
         val &= 0xFFFFFFFF
+        self._before_write(addr, 4)
         self.data[addr] = val & 0xFF
         self.data[addr + 1] = (val >> 8) & 0xFF
         self.data[addr + 2] = (val >> 16) & 0xFF
         self.data[addr + 3] = val >> 24
+        self._after_write(addr, 4)
 
     def write_ptr(self, addr: int, val: int) -> None:
         """
@@ -210,11 +530,98 @@ class Rom:
             size = len(vals) - val_addr
         data_end = data_addr + size
         val_end = val_addr + size
+        self._before_write(data_addr, size)
         self.data[data_addr:data_end] = vals[val_addr:val_end]
+        self._after_write(data_addr, size)
+
+    def write_u16_array(self, addr: int, vals: Sequence[int]) -> None:
+        """Writes a sequence of numbers as 16-bit integers to a specified address."""
+        self._write_array("H", addr, vals)
+
+    def write_u32_array(self, addr: int, vals: Sequence[int]) -> None:
+        """Writes a sequence of numbers as 32-bit integers to a specified address."""
+        self._write_array("I", addr, vals)
+
+    def _write_array(self, typecode: Literal["H", "I"], addr: int, vals: Sequence[int]) -> None:
+        arr = array(typecode, vals)
+        if sys.byteorder != "little":
+            arr.byteswap()
+        self.write_bytes(addr, arr.tobytes())
+
+    def write_record(self, layout: RecordLayout[T], addr: int, record: T) -> None:
+        """
+        Writes a record with the specified layout to an address. Pointers in the record are
+        written as is.
+        """
+        self._before_write(addr, layout.size)
+        layout.write(self.data, addr, record)
+        self._after_write(addr, layout.size)
+
+    def _before_write(self, addr: int, size: int) -> None:
+        # Called by every write method before the data at an address is changed
+        if self._transactions:
+            self._transactions[-1].record(self.data, addr, size)
+        self._fork_base = None
+        if self._view is not self._data:
+            # The CowBuffer is about to copy a page, so its base is no longer up to date
+            self._view = None
+
+    def _after_write(self, addr: int, size: int) -> None:
+        # Called by every write method after the data at an address is changed
+        if self.journal is not None:
+            self.journal.record(addr, size)
+        if self.asset_cache is not None:
+            self.asset_cache.invalidate(addr, size)
+        if self.pointer_index is not None:
+            # Pointers may have been written, so add any words that look like pointers
+            start = addr & ~3
+            end = min(align(addr + size), len(self.data))
+            self.pointer_index.add_words(start, self.data[start:end])
+
+    def _before_free_space_change(self) -> None:
+        # Called by every method that changes the allocator, allocations, or dedup index.
+        # Transactions that haven't saved the free space state were all made since it last
+        # changed, so they share one copy
+        state = None
+        for txn in reversed(self._transactions):
+            if txn._free_space is not None:
+                break
+            if state is None:
+                state = _FreeSpaceState.save(self)
+            txn._free_space = state
+
+    def replace_data(
+        self, data: RomData, changed_ranges: Sequence[tuple[int, int]] | None = None
+    ) -> None:
+        """
+        Replaces all of the data, such as with the output of a BPS patch, and updates the
+        journal, caches, and active transaction the same way the write methods do. If the
+        (start, end) ranges that changed are known, they're recorded in the journal instead of
+        comparing the old and new data.
+        """
+        old = self.data
+        if self._transactions:
+            self._transactions[-1].record_replace(old)
+        self.data = data
+        if self.journal is not None:
+            if changed_ranges is None:
+                self.journal.record_changes(old, data)
+            else:
+                for start, end in changed_ranges:
+                    self.journal.record(start, end - start)
+        if self.asset_cache is not None:
+            self.asset_cache.clear()
+        # Pointers are found again the next time they're looked up
+        self.pointer_index = None
+
+    def write_records(self, layout: RecordLayout[T], addr: int, records: Sequence[T]) -> None:
+        """Writes an array of records with the specified layout, starting at an address."""
+        vals = b"".join(layout.pack(record) for record in records)
+        self.write_bytes(addr, vals)
 
     def copy_bytes(self, src_addr: int, dst_addr: int, size: int) -> None:
         """Copies a specified amount of bytes from the source address to the destination address."""
-        self.write_bytes(dst_addr, self.data, src_addr, size)
+        self.write_bytes(dst_addr, self.read_bytes(src_addr, size))
 
     @staticmethod
     def align_4_bytes(num: int) -> int:
@@ -223,79 +630,485 @@ class Rom:
             num += 4 - remain
         return num
 
+    @property
+    def free_space_addr(self) -> int:
+        """The start of the unused space at the end of the reserved free space."""
+        block = self.allocator.block_containing(self.free_space_end - 1)
+        if block is None or block[1] != self.free_space_end:
+            return self.free_space_end
+        return block[0]
+
+    @property
+    def free_spaces(self) -> dict[int, int]:
+        """All free blocks. Keys are addresses, values are sizes."""
+        return {start: end - start for start, end in self.allocator.blocks()}
+
+    def expand(self, size: int) -> None:
+        """
+        Expands the ROM to 16 MB or 32 MB. The new space is filled with 0xFF and added to the
+        free space, so repointed data can be placed there. The data is copied into a new
+        buffer, so forked ROMs no longer share pages.
+
+        Raises:
+            ValueError: If the size is not 16 MB or 32 MB, or is smaller than the current size.
+        """
+        if size not in (SIZE_16MB, SIZE_32MB):
+            raise ValueError("ROM can only be expanded to 16MB or 32MB")
+        old_size = len(self.data)
+        if size < old_size:
+            raise ValueError(f"ROM is already larger than 0x{size:X} bytes")
+        if size == old_size:
+            return
+        # A new buffer is made, so views of the current data stay valid
+        data = self.flat_data() + b"\xff" * (size - old_size)
+        self.replace_data(data, [(old_size, size)])
+        self._before_free_space_change()
+        self.allocator.free(old_size, size - old_size)
+
+    def space_report(self) -> str:
+        """Returns a summary of how much of each kind of free space has been used."""
+
+        def usage(name: str, start: int, end: int) -> str:
+            size = end - start
+            used = size - self.allocator.free_size_in(start, end)
+            return f"{name}: 0x{used:X}/0x{size:X} used ({used / size:.2%})"
+
+        lines = [usage("Reserved free space", self.free_space_start, self.free_space_end)]
+        if len(self.data) > SIZE_8MB:
+            lines.append(usage("Expanded space", SIZE_8MB, len(self.data)))
+        stats = self.allocator.stats()
+        other_free = (
+            stats.free_size
+            - self.allocator.free_size_in(self.free_space_start, self.free_space_end)
+            - self.allocator.free_size_in(SIZE_8MB, len(self.data))
+        )
+        lines.append(f"Other free space (freed or discovered): 0x{other_free:X}")
+        lines.append(
+            f"Total free: 0x{stats.free_size:X} in {stats.block_count} blocks, "
+            f"largest block: 0x{stats.largest_block:X}, "
+            f"fragmentation: {stats.fragmentation:.2%}"
+        )
+        return "\n".join(lines)
+
     def reserve_free_space(self, data_size: int) -> int:
         """
-        Returns an address that is able to fit data with the specified size. The alignment is
-        always 4.
+        Returns an address that is able to fit data with the specified size. The smallest free
+        block that fits is used, and the alignment is always 4.
+
+        Raises:
+            RuntimeError: If no free block is large enough.
         """
-        # Check for existing free space that can fit the specified size
-        data_addr: int | None = None
-        for free_addr, free_size in self.free_spaces.items():
-            if data_size <= free_size:
-                data_addr = free_addr
-                break
-        if data_addr is not None:
-            # Remove found entry
-            free_size = self.free_spaces.pop(data_addr)
-            # Add new entry if there's still space remaining (align to 4 bytes first)
-            free_addr = self.align_4_bytes(data_addr + data_size)
-            free_size -= free_addr - data_addr
-            if free_size >= 4:
-                self.free_spaces[free_addr] = free_size
-        else:
-            # No existing free space found, use end of ROM
-            self.free_space_addr = self.align_4_bytes(self.free_space_addr)
-            data_addr = self.free_space_addr
-            self.free_space_addr += data_size
-            # Check if past end of reserved space
-            if self.is_mf():
-                free_space_end = ReservedConstantsMF.PATCHER_FREE_SPACE_END
-            elif self.is_zm():
-                free_space_end = ReservedConstantsZM.PATCHER_FREE_SPACE_END
-            else:
-                raise ValueError(self.game)
-            if self.free_space_addr > free_space_end:
-                raise RuntimeError("Ran out of reserved free space")
+        self._before_free_space_change()
+        data_addr = self.allocator.allocate(data_size)
+        if data_addr is None:
+            raise RuntimeError("Ran out of reserved free space")
         return data_addr
 
+    def find_pointers(self, addr: int) -> list[int]:
+        """
+        Returns the 4-byte aligned locations of all pointers to the specified address. The ROM is
+        scanned for pointers once, the first time this is called; afterwards, each lookup only
+        checks the locations that were found for the address. Any word that looks like a
+        pointer to the address is returned, so this should only be used for addresses that
+        data is unlikely to coincidentally match.
+        """
+        val = addr + ROM_OFFSET
+        candidates = self._get_pointer_index().candidates(addr)
+        return [loc for loc in candidates if self.read_32(loc) == val]
+
+    def _get_pointer_index(self) -> PointerIndex:
+        if self.pointer_index is None:
+            self.pointer_index = PointerIndex(self.flat_data(), ROM_OFFSET)
+        return self.pointer_index
+
+    def discover_free_space(
+        self,
+        min_size: int = PADDING_MIN_SIZE,
+        fill_values: tuple[int, ...] = (0xFF, 0x00),
+        exclude: Sequence[tuple[int, int]] = (),
+    ) -> int:
+        """
+        Finds long runs of padding before the reserved free space and adds them to the
+        allocator. The excluded (start, end) ranges should be data whose size is known, such as
+        data tables. Runs are skipped if they contain the target of any pointer or overlap an
+        excluded range. Runs are also skipped unless the nearest pointer target before them is
+        within an excluded range that ends before the run, since otherwise the padding may be
+        the end of the data at that target. This should be called before any data is written to
+        free space, since that data may itself contain runs of padding. Returns the total size
+        of the space that was added.
+        """
+        self._before_free_space_change()
+        pointer_index = self._get_pointer_index()
+        added = 0
+        runs = find_padding(self.flat_data(), 0, self.free_space_start, min_size, fill_values)
+        for run_start, run_end in runs:
+            if pointer_index.has_targets_in(run_start, run_end):
+                continue
+            if any(run_start < ex_end and ex_start < run_end for ex_start, ex_end in exclude):
+                continue
+            target = pointer_index.nearest_target_before(run_start)
+            if target is not None and not any(
+                ex_start <= target < ex_end <= run_start for ex_start, ex_end in exclude
+            ):
+                continue
+            start = run_start + PADDING_GUARD_SIZE
+            self.allocator.free(start, run_end - start)
+            added += run_end - start
+        return added
+
+    def compact_free_space(self) -> int:
+        """
+        Moves data that was written to free space so it's packed together at the start of the
+        reserved free space (and the expanded space, if any), leaving one large free block at
+        the end. Only data in self.allocations whose pointers still point to it, and that no
+        other pointers point to, is moved. All other used space stays where it is; data after
+        it is moved into the gaps before it when it fits, and otherwise packed right after it.
+        This should be called after all data has been written. Returns the number of blocks
+        that were moved.
+        """
+        arenas = [(self.free_space_start, self.free_space_end)]
+        if len(self.data) > SIZE_8MB:
+            arenas.append((SIZE_8MB, len(self.data)))
+        # Unless the pointer index was already built, only scan for pointers to data that can
+        # be moved
+        index = self.pointer_index
+        if index is None:
+            index = PointerIndex(self.flat_data(), ROM_OFFSET, list(self.allocations))
+        moved = 0
+        for arena_start, arena_end in arenas:
+            # Everything before the cursor is either packed data, data that can't be moved, or
+            # one of the holes left before data that can't be moved
+            cursor = arena_start
+            holes: list[tuple[int, int]] = []
+            for used_start, used_end in self.allocator.used_ranges(arena_start, arena_end):
+                pos = used_start
+                addrs = sorted(a for a in self.allocations if used_start <= a < used_end)
+                for addr in addrs:
+                    alloc = self.allocations[addr]
+                    if addr > align(pos):
+                        # Unknown data before this block, not just alignment padding
+                        cursor = self._skip_to(holes, cursor, pos, addr)
+                    new_addr = None
+                    if self._is_movable(index, addr, alloc, used_end):
+                        new_addr = self._take_hole(holes, alloc.size)
+                        if new_addr is None and align(cursor) < addr:
+                            new_addr = align(cursor)
+                    if new_addr is not None:
+                        self._move_allocation(index, addr, new_addr)
+                        moved += 1
+                        if new_addr >= cursor:
+                            cursor = new_addr + alloc.size
+                    else:
+                        cursor = self._skip_to(holes, cursor, addr, addr + alloc.size)
+                    pos = max(pos, align(addr + alloc.size))
+                if pos < used_end:
+                    cursor = self._skip_to(holes, cursor, pos, used_end)
+        return moved
+
+    @staticmethod
+    def _skip_to(holes: list[tuple[int, int]], cursor: int, start: int, end: int) -> int:
+        # Moves the cursor past data in [start, end) that stays in place
+        hole_start = align(cursor)
+        if hole_start < start:
+            holes.append((hole_start, start))
+        return max(cursor, end)
+
+    @staticmethod
+    def _take_hole(holes: list[tuple[int, int]], size: int) -> int | None:
+        # Returns the address of the first hole that fits the size, and shrinks that hole
+        for i, (start, end) in enumerate(holes):
+            if end - start >= size:
+                new_start = align(start + size)
+                if new_start < end:
+                    holes[i] = (new_start, end)
+                else:
+                    del holes[i]
+                return start
+        return None
+
+    def _is_movable(self, index: PointerIndex, addr: int, alloc: Allocation, used_end: int) -> bool:
+        if not alloc.pointers or addr + alloc.size > used_end:
+            return False
+        val = addr + ROM_OFFSET
+        if not all(self.read_32(ptr) == val for ptr in alloc.pointers):
+            return False
+        # Data may also be shared by pointers that were written without being recorded, which
+        # would be left pointing at whatever is moved there next
+        known = set(alloc.pointers)
+        return all(ptr in known or self.read_32(ptr) != val for ptr in index.candidates(addr))
+
+    def _move_allocation(self, index: PointerIndex, addr: int, new_addr: int) -> None:
+        self._before_free_space_change()
+        alloc = self.allocations.pop(addr)
+        moved_data = self.read_bytes(addr, alloc.size)
+        self.write_bytes(new_addr, moved_data)
+        if index is not self.pointer_index:
+            # Pointers in the moved data are only added to the pointer index automatically
+            index.add_words(new_addr, moved_data)
+        for ptr in alloc.pointers:
+            self.write_ptr(ptr, new_addr)
+        # Allocations always take up a multiple of the alignment
+        size = align(alloc.size)
+        self.allocator.free(addr, size)
+        self.allocator.reserve(new_addr, size)
+        self.allocations[new_addr] = alloc
+        if self.dedup is not None:
+            self.dedup.move(addr, new_addr)
+        # Pointers stored inside the moved data have moved with it
+        end = addr + alloc.size
+        offset = new_addr - addr
+        for other in self.allocations.values():
+            for i, ptr in enumerate(other.pointers):
+                if addr <= ptr < end:
+                    other.pointers[i] = ptr + offset
+
     def write_repointable_data(
-        self, addr: int, prev_size: int, vals: BytesLike, pointers: Sequence[int]
+        self, addr: int, prev_size: int, vals: BytesLike, pointers: Sequence[int] | None
     ) -> int:
         """
         Writes data that may have changed size. If bigger than its previous size, new space will
-        be allocated and the provided pointers will be repointed. The provided address and
-        previous size are used to mark the original location as free space. Returns the address
-        where the data was written.
+        be allocated and the provided pointers will be repointed. Pointers should be provided
+        whenever they're known; passing None instead finds them with find_pointers(). The
+        provided address and previous size are used to mark the original location as free
+        space. Returns the address where the data was written.
         """
-        # Ensure each pointer points to the provided address
-        for ptr in pointers:
-            if self.read_ptr(ptr) != addr:
-                raise ValueError(f"Expected pointer at 0x{ptr:X} to be 0x{addr:X}")
+        if pointers is None:
+            pointers = self.find_pointers(addr)
+            if not pointers:
+                raise ValueError(f"No pointers to 0x{addr:X} found")
+        else:
+            # Ensure each pointer points to the provided address
+            for ptr in pointers:
+                if self.read_ptr(ptr) != addr:
+                    raise ValueError(f"Expected pointer at 0x{ptr:X} to be 0x{addr:X}")
+        self._before_free_space_change()
+        if self.dedup is not None:
+            if self.dedup.is_shared(addr):
+                # Other pointers still use the data, so write a separate copy
+                self.dedup.release(addr)
+                alloc = self.allocations.get(addr)
+                if alloc is not None:
+                    alloc.pointers = [p for p in alloc.pointers if p not in pointers]
+                return self.write_data_with_pointers(vals, pointers)
+            self.dedup.forget(addr)
         write_addr = addr
         if len(vals) > prev_size:
             # Data is bigger, so reserve new space and repoint pointers
             write_addr = self.reserve_free_space(len(vals))
             for ptr in pointers:
                 self.write_ptr(ptr, write_addr)
-            # Mark the original location as free space (align to 4 bytes first)
-            free_addr = self.align_4_bytes(addr)
-            free_size = prev_size - (free_addr - addr)
-            self.free_spaces[free_addr] = free_size
+            # Mark the original location as free space, including any space it was allocated
+            # but didn't use (allocations always take up a multiple of the alignment)
+            alloc = self.allocations.pop(addr, None)
+            if alloc is not None:
+                prev_size = max(prev_size, align(alloc.size))
+            self.allocator.free(addr, prev_size)
+            self.allocations[write_addr] = Allocation(len(vals), list(pointers))
         self.write_bytes(write_addr, vals)
         return write_addr
 
     def write_data_with_pointers(self, vals: BytesLike, pointers: Sequence[int]) -> int:
         """
         Writes data by allocating new space and writes the address to the provided pointers.
-        Returns the address where the data was written.
+        If deduplication is enabled and identical data was already written, the existing copy
+        is used instead. Returns the address where the data was written.
         """
+        self._before_free_space_change()
+        key = None
+        if self.dedup is not None:
+            key = self.dedup.key(vals)
+            addr = self.dedup.find(key)
+            # Check the data is still there, in case it was overwritten
+            if addr is not None and self.read_bytes(addr, len(vals)) == vals:
+                for ptr in pointers:
+                    self.write_ptr(ptr, addr)
+                self.dedup.share(addr, len(vals))
+                alloc = self.allocations.get(addr)
+                if alloc is not None:
+                    alloc.pointers.extend(pointers)
+                return addr
         addr = self.reserve_free_space(len(vals))
         for ptr in pointers:
             self.write_ptr(ptr, addr)
         self.write_bytes(addr, vals)
+        self.allocations[addr] = Allocation(len(vals), list(pointers))
+        if key is not None:
+            assert self.dedup is not None
+            self.dedup.add(key, addr)
         return addr
 
-    def save(self, path: str | PathLike[str]) -> None:
-        """Saves the currently loaded data to a specified path."""
-        with open(path, "wb") as f:
-            f.write(self.data)
+    def enable_journal(self) -> WriteJournal:
+        """
+        Starts recording all writes to the data, and returns the journal they are recorded in.
+        Returns the existing journal if one was already enabled.
+        """
+        if self.journal is None:
+            self.journal = WriteJournal()
+        return self.journal
+
+    def enable_deduplication(self) -> DedupIndex:
+        """
+        Makes write_data_with_pointers reuse existing copies of identical data, and returns the
+        index used to find them. Returns the existing index if one was already enabled.
+        """
+        if self.dedup is None:
+            self._before_free_space_change()
+            self.dedup = DedupIndex()
+        return self.dedup
+
+    def enable_asset_cache(self) -> AssetCache:
+        """
+        Makes read_lz77 and read_rle cache the data they decompress, and returns the cache.
+        Returns the existing cache if one was already enabled.
+        """
+        if self.asset_cache is None:
+            self.asset_cache = AssetCache()
+        return self.asset_cache
+
+    @contextmanager
+    def transaction(self) -> Iterator[Transaction]:
+        """
+        Makes a checkpoint that the ROM can be rolled back to, for trying changes that may need
+        to be undone. If an exception is raised inside the with block, all changes made in it
+        are rolled back before the exception propagates; changes can also be rolled back
+        explicitly with the Transaction's rollback(). Transactions can be nested, and changes
+        kept by an inner transaction are rolled back along with its outer transaction.
+
+        The journal and pointer index are not rolled back. Rolled back ranges stay in the
+        journal, and pointers that were written are checked when they're looked up.
+        """
+        txn = Transaction(self)
+        self._transactions.append(txn)
+        try:
+            yield txn
+        except BaseException:
+            txn.rollback()
+            raise
+        finally:
+            self._transactions.pop()
+        if self._transactions:
+            txn._merge_into(self._transactions[-1])
+
+    def set_journal_step(self, step: str) -> None:
+        """Sets the step that following writes are tagged with, if a journal is enabled."""
+        if self.journal is not None:
+            self.journal.step = step
+
+    def fork(self) -> "Rom":
+        """
+        Returns a copy-on-write clone of this ROM. The clone shares all data with this ROM in
+        4 KB pages, and a page is only duplicated when the clone writes to it. If this ROM's
+        data is a bytearray, it stays one; the clones share a snapshot of it instead, which is
+        taken once and reused by later forks until this ROM is written to.
+        """
+        if isinstance(self.data, bytearray):
+            if self._fork_base is None:
+                self._fork_base = bytes(self.data)
+            data = CowBuffer(self._fork_base)
+        else:
+            data = self.data.fork()
+        clone = copy.copy(self)
+        clone.data = data
+        clone._mmap = None
+        clone.allocator = self.allocator.copy()
+        clone.allocations = _copy_allocations(self.allocations)
+        clone._transactions = []
+        if self.journal is not None:
+            clone.journal = self.journal.copy()
+        if self.dedup is not None:
+            clone.dedup = self.dedup.copy()
+        if self.pointer_index is not None:
+            clone.pointer_index = self.pointer_index.fork()
+        if self.asset_cache is not None:
+            clone.asset_cache = self.asset_cache.fork()
+        return clone
+
+    def close(self) -> None:
+        """
+        Closes the memory mapped file of a ROM created with from_mmap(). Does nothing for other
+        ROMs. The ROM can't be used afterwards, and neither can any forks of it that still read
+        from the file, so they should no longer be used by the time this is called.
+        """
+        if self._mmap is None:
+            return
+        # Every view of the file must be released before it can be closed
+        self._view = None
+        self._cow.release()
+        self._mmap.close()
+        self._mmap = None
+
+    def __enter__(self) -> "Rom":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        self.close()
+
+    def flat_data(self) -> bytearray:
+        """
+        Returns the data as one contiguous bytearray. For ROMs that are not forked, this is the
+        data itself; for forked ROMs, it's a new bytearray with the pages combined.
+        """
+        if isinstance(self.data, bytearray):
+            return self.data
+        return self.data.flatten()
+
+    def keep_original_data(self) -> None:
+        """
+        Keeps a copy of the current data, so the ROM can later be saved as a patch against it.
+        This should be called before any changes are made. Also enables the journal, so only
+        the written ranges need to be compared when creating the patch. Original data that was
+        already provided, such as by a SharedRomImage, is kept as is.
+        """
+        if self.original_data is None:
+            self.original_data = bytes(self.flat_data())
+        self.enable_journal()
+
+    def save(
+        self, path: str | PathLike[str] | BinaryIO, output_format: OutputFormat = OutputFormat.ROM
+    ) -> None:
+        """
+        Saves the currently loaded data to a specified path or binary file object, either as a
+        full ROM or as a patch against the original data.
+
+        Raises:
+            ValueError: If saving as a patch and the original data was not kept.
+        """
+        output = self._output_data(output_format)
+        if isinstance(path, (str, PathLike)):
+            with open(path, "wb") as f:
+                f.write(output)
+        else:
+            path.write(output)
+
+    def to_bytes(self, output_format: OutputFormat = OutputFormat.ROM) -> bytes:
+        """
+        Returns the currently loaded data, either as a full ROM or as a patch against the
+        original data.
+
+        Raises:
+            ValueError: If returning a patch and the original data was not kept.
+        """
+        return bytes(self._output_data(output_format))
+
+    def _output_data(self, output_format: OutputFormat) -> BytesLike:
+        if output_format == OutputFormat.ROM:
+            output: BytesLike = self.flat_data()
+        else:
+            if self.original_data is None:
+                raise ValueError("Original data must be kept to save as a patch")
+            dirty_ranges = None
+            if self.journal is not None:
+                dirty_ranges = self.journal.dirty_ranges()
+            if output_format == OutputFormat.BPS:
+                encoder: BpsEncoder | IpsEncoder = BpsEncoder()
+            elif output_format == OutputFormat.IPS:
+                encoder = IpsEncoder()
+            else:
+                raise ValueError(output_format)
+            output = encoder.create_patch(self.original_data, self.flat_data(), dirty_ranges)
+        return output
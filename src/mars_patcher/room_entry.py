@@ -2,7 +2,7 @@ from __future__ import annotations
 
 from typing import TYPE_CHECKING
 
-from mars_patcher.compress import comp_rle, decomp_rle
+from mars_patcher.compress import comp_rle
 from mars_patcher.constants.game_data import area_room_entry_ptrs
 
 if TYPE_CHECKING:
@@ -11,10 +11,13 @@ if TYPE_CHECKING:
     from mars_patcher.rom import Rom
 
 
+ROOM_ENTRY_SIZE = 0x3C
+
+
 class RoomEntry:
     def __init__(self, rom: Rom, area: int, room: int):
         self.rom = rom
-        self.addr = rom.read_ptr(area_room_entry_ptrs(rom) + area * 4) + room * 0x3C
+        self.addr = rom.read_ptr(area_room_entry_ptrs(rom) + area * 4) + room * ROOM_ENTRY_SIZE
 
     def bg1_ptr(self) -> int:
         return self.addr + 0xC
@@ -85,7 +88,7 @@ class BlockLayer:
         self.pointer = ptr
         self.width = rom.read_8(addr)
         self.height = rom.read_8(addr + 1)
-        self.block_data, comp_size = decomp_rle(rom.data, addr + 2)
+        self.block_data, comp_size = rom.read_rle(addr + 2)
         self.data_size = comp_size + 2
 
     def get_block_value(self, x: int, y: int) -> int:
@@ -108,7 +111,9 @@ class BlockLayer:
         self.block_data[idx + 1] = value >> 8
 
     def write(self) -> None:
-        data = bytearray([self.width, self.height]) + comp_rle(self.block_data)
+        data = bytearray([self.width, self.height]) + comp_rle(
+            self.block_data, self.rom.compression_cache
+        )
         addr = self.rom.read_ptr(self.pointer)
         self.rom.write_repointable_data(addr, self.data_size, data, [self.pointer])
         self.data_size = len(data)
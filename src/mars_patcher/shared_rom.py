@@ -0,0 +1,158 @@
+import sys
+from collections.abc import Callable
+from multiprocessing.shared_memory import SharedMemory
+from types import TracebackType
+
+from mars_patcher.asset_cache import AssetCache
+from mars_patcher.common_types import BytesLike
+from mars_patcher.rom import Rom
+from mars_patcher.write_journal import DEFAULT_STEP
+
+
+def _attach(name: str) -> SharedMemory:
+    if sys.version_info >= (3, 13):
+        # Only the creating process should unlink the memory
+        return SharedMemory(name, track=False)
+    return SharedMemory(name)
+
+
+class SharedRomImage:
+    """
+    A ROM placed in shared memory once, so any number of processes can create ROMs from it
+    without reading, base patching, or copying the data again. Each ROM created from the image
+    is a copy-on-write view of the shared data, so a worker only uses memory for the 4 KB
+    pages it writes to.
+
+    The image can be pickled and sent to worker processes, which attach to the same shared
+    memory by name. Before Python 3.13, workers should be started by multiprocessing from the
+    process that created the image, so they share its resource tracker; otherwise the memory
+    may be unlinked when a worker exits.
+
+    ROMs created from the same image object share the assets they decompress, as long as the
+    compressed data wasn't changed. In a worker pool, the image can be passed to each worker
+    once with an initializer, so all ROMs in a worker share the assets.
+
+    The process that created the image must call unlink() once every worker is done with it;
+    using the image as a context manager does this on exit. close() can only be called once
+    all ROMs created from the image are no longer used.
+
+    Attributes:
+        name: The name of the shared memory block.
+        size: The size of the ROM data.
+        original_size: The size of the original data that patches are created against, or 0
+                       if the original data was not kept.
+        base_patch_applied: Whether the base asm patch was already applied to the data.
+    """
+
+    def __init__(
+        self,
+        shm: SharedMemory,
+        size: int,
+        original_size: int,
+        base_patch_applied: bool,
+        journal_steps: dict[str, list[tuple[int, int]]] | None,
+        owner: bool = False,
+    ):
+        self._shm = shm
+        self._owner = owner
+        self.name = shm.name
+        self.size = size
+        self.original_size = original_size
+        self.base_patch_applied = base_patch_applied
+        # The ranges written by each step before the image was created
+        self._journal_steps = journal_steps
+        # Decompressed assets shared by the ROMs created in this process
+        self._asset_cache: AssetCache | None = None
+
+    @classmethod
+    def create(cls, rom: Rom, original_data: BytesLike | None = None) -> "SharedRomImage":
+        """
+        Copies a ROM's data into a new shared memory block. The ROM's original data, or the
+        provided original data, is stored along with it, so workers can save patches against
+        it. The ranges recorded by the ROM's journal, such as the ones written by the base
+        patch, are also stored, so workers only compare those ranges when creating patches.
+        If the base patch was already applied and no original data is available, ROMs created
+        from the image can only be saved as full ROMs.
+        """
+        data = rom.flat_data()
+        original = rom.original_data if original_data is None else original_data
+        original_size = 0 if original is None else len(original)
+        shm = SharedMemory(create=True, size=len(data) + original_size)
+        buf = shm.buf
+        assert buf is not None
+        buf[: len(data)] = data
+        if original is not None:
+            buf[len(data) : len(data) + original_size] = original
+        del buf
+        journal_steps = None
+        if rom.journal is not None:
+            journal_steps = {name: list(step.ranges) for name, step in rom.journal.steps.items()}
+        return cls(shm, len(data), original_size, rom.base_patch_applied, journal_steps, True)
+
+    def rom(self) -> Rom:
+        """
+        Creates a ROM from the image. The shared data is never modified; the ROM copies each
+        page the first time it's written to.
+
+        Raises:
+            ValueError: If the data is not a valid ROM.
+        """
+        buf = self._shm.buf
+        assert buf is not None
+        rom = Rom.from_buffer(buf[: self.size].toreadonly())
+        rom.base_patch_applied = self.base_patch_applied
+        if self.original_size:
+            end = self.size + self.original_size
+            rom.original_data = buf[self.size : end].toreadonly()
+        if self._journal_steps is not None:
+            journal = rom.enable_journal()
+            for name, ranges in self._journal_steps.items():
+                journal.step = name
+                for start, end in ranges:
+                    journal.record(start, end - start)
+            journal.step = DEFAULT_STEP
+        if self._asset_cache is None:
+            self._asset_cache = AssetCache()
+        rom.asset_cache = self._asset_cache.fork()
+        return rom
+
+    def close(self) -> None:
+        """Detaches this process from the shared memory."""
+        self._shm.close()
+
+    def unlink(self) -> None:
+        """Frees the shared memory once every process has closed it."""
+        self._shm.unlink()
+
+    def __enter__(self) -> "SharedRomImage":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        self.close()
+        if self._owner:
+            self.unlink()
+
+    def __reduce__(self) -> tuple[Callable[..., "SharedRomImage"], tuple]:
+        args = (
+            self.name,
+            self.size,
+            self.original_size,
+            self.base_patch_applied,
+            self._journal_steps,
+        )
+        return (_attach_image, args)
+
+
+def _attach_image(
+    name: str,
+    size: int,
+    original_size: int,
+    base_patch_applied: bool,
+    journal_steps: dict[str, list[tuple[int, int]]] | None,
+) -> SharedRomImage:
+    return SharedRomImage(_attach(name), size, original_size, base_patch_applied, journal_steps)
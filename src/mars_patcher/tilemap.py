@@ -2,11 +2,13 @@ from enum import Enum, auto
 from types import TracebackType
 
 from mars_patcher.common_types import MinimapId
-from mars_patcher.compress import comp_lz77, decomp_lz77
+from mars_patcher.compress import comp_lz77, comp_lz77_to_fit
 from mars_patcher.constants.game_data import minimap_ptrs
 from mars_patcher.convert_array import u8_to_u16, u16_to_u8
 from mars_patcher.rom import Rom
 
+MAX_TILESET_TILEMAP_LEN = 1024 * 4
+
 
 class TilemapType(Enum):
     TILESET = auto()
@@ -27,21 +29,21 @@ class Tilemap:
         self.data: list[int] = []
         if type == TilemapType.TILESET:
             addr += 2
-            while True:
-                val = rom.read_16(addr)
-                if val == 0:
-                    if len(self.data) % 4 != 0:
-                        raise ValueError("Tilemap length should be a multiple of 4")
-                    break
-                if len(self.data) >= 1024 * 4:
-                    raise ValueError("Tilemap is too long")
-                self.data.append(val)
-                addr += 2
+            # Read the longest possible tilemap and its terminator, then find the terminator
+            count = min(MAX_TILESET_TILEMAP_LEN + 1, (len(rom.data) - addr) // 2)
+            vals = rom.read_u16_array(addr, count)
+            try:
+                end = vals.index(0)
+            except ValueError:
+                raise ValueError("Tilemap is too long") from None
+            if end % 4 != 0:
+                raise ValueError("Tilemap length should be a multiple of 4")
+            self.data = vals[:end]
             self.data_size = len(self.data) * 2 + 4
         elif type == TilemapType.BACKGROUND:
             raise NotImplementedError()
         elif type == TilemapType.MISC:
-            data, self.data_size = decomp_lz77(rom.data, addr)
+            data, self.data_size = rom.read_lz77(addr)
             self.data = u8_to_u16(data)
 
     def __enter__(self) -> "Tilemap":
@@ -90,20 +92,29 @@ class Tilemap:
             value |= 0x800
         self.data[idx] = value
 
-    def byte_data(self) -> bytes:
+    def byte_data(self, max_size: int | None = None) -> bytes:
+        """
+        Returns the tilemap as it's stored in the ROM. If a maximum size is provided, compressed
+        data is compressed with increasing effort until it fits in that size.
+        """
         if self.type == TilemapType.TILESET:
             return bytes([2, 0]) + u16_to_u8(self.data) + bytes([0, 0])
         elif self.type == TilemapType.BACKGROUND:
             raise NotImplementedError()
         elif self.type == TilemapType.MISC:
-            data = comp_lz77(u16_to_u8(self.data))
+            if max_size is None:
+                data = comp_lz77(u16_to_u8(self.data), cache=self.rom.compression_cache)
+            else:
+                data = comp_lz77_to_fit(u16_to_u8(self.data), max_size, self.rom.compression_cache)
             return bytes(data)
 
     def write(self, copy: bool) -> None:
-        data = self.byte_data()
         if copy:
+            data = self.byte_data()
             self.rom.write_data_with_pointers(data, [self.pointer])
         else:
+            # Try to fit the data in its original location, so it doesn't need to be repointed
+            data = self.byte_data(self.data_size)
             addr = self.rom.read_ptr(self.pointer)
             self.rom.write_repointable_data(addr, self.data_size, data, [self.pointer])
 
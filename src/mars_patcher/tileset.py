@@ -1,15 +1,37 @@
+from typing import NamedTuple
+
 from mars_patcher.constants.game_data import anim_tileset_entries, tileset_entries
+from mars_patcher.record_view import RecordLayout
 from mars_patcher.rom import Rom
 
 TILESET_SIZE = 0x14
 ANIM_TILESET_SIZE = 0x30
 
 
+class TilesetEntry(NamedTuple):
+    """The fields of a tileset entry. Pointers are stored as is, including the ROM offset."""
+
+    block_bg_gfx_ptr: int
+    palette_ptr: int
+    tiled_bg_gfx_ptr: int
+    tilemap_ptr: int
+    anim_tileset: int
+    anim_palette: int
+    padding: bytes
+
+
+TILESET_ENTRY = RecordLayout(TilesetEntry, "4I2B2s")
+
+
 class Tileset:
     def __init__(self, rom: Rom, id: int):
         self.rom = rom
         self.addr = tileset_entries(rom) + id * TILESET_SIZE
 
+    def read(self) -> TilesetEntry:
+        """Reads all fields of the tileset entry at once."""
+        return self.rom.read_record(TILESET_ENTRY, self.addr)
+
     def block_bg_gfx_ptr(self) -> int:
         return self.addr
 
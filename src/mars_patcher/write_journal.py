@@ -0,0 +1,101 @@
+from collections.abc import Callable
+from dataclasses import dataclass, field
+
+from mars_patcher.common_types import BytesLike, RomData
+from mars_patcher.range_set import RangeSet
+
+DEFAULT_STEP = "Unknown"
+
+DIFF_BLOCK_SIZE = 0x100
+"""The granularity used when recording the differences between two buffers."""
+
+
+@dataclass
+class StepWrites:
+    """The writes made by a single pipeline step."""
+
+    write_count: int = 0
+    """How many write operations were made."""
+    bytes_written: int = 0
+    """The total size of all writes, including bytes that were written more than once."""
+    ranges: RangeSet = field(default_factory=RangeSet)
+    """The coalesced ranges that were written."""
+
+    @property
+    def bytes_dirtied(self) -> int:
+        """The number of distinct bytes that were written."""
+        return self.ranges.total_size()
+
+    @property
+    def write_amplification(self) -> float:
+        """The ratio of bytes written to distinct bytes written."""
+        dirtied = self.bytes_dirtied
+        return self.bytes_written / dirtied if dirtied else 0.0
+
+
+class WriteJournal:
+    """
+    Records every write made to a ROM as coalesced dirty ranges. Writes are tagged with the
+    current step, so the changes made by each part of the patching pipeline can be inspected.
+
+    Attributes:
+        step: The name of the step that is currently writing to the ROM.
+        dirty: The coalesced ranges written by all steps.
+        steps: The writes made by each step, in the order the steps started.
+    """
+
+    def __init__(self) -> None:
+        self.step = DEFAULT_STEP
+        self.dirty = RangeSet()
+        self.steps: dict[str, StepWrites] = {}
+
+    def record(self, addr: int, size: int) -> None:
+        """Records a write of a specified size to an address."""
+        if size <= 0:
+            return
+        end = addr + size
+        self.dirty.add(addr, end)
+        step = self.steps.get(self.step)
+        if step is None:
+            step = StepWrites()
+            self.steps[self.step] = step
+        step.write_count += 1
+        step.bytes_written += size
+        step.ranges.add(addr, end)
+
+    def record_changes(self, old: BytesLike | RomData, new: BytesLike | RomData) -> None:
+        """
+        Records the differences between two buffers, for writes that replaced the data without
+        going through the ROM. Differences are found in blocks of DIFF_BLOCK_SIZE bytes.
+        """
+        size = max(len(old), len(new))
+        for addr in range(0, size, DIFF_BLOCK_SIZE):
+            end = addr + DIFF_BLOCK_SIZE
+            if old[addr:end] != new[addr:end]:
+                self.record(addr, min(end, size) - addr)
+
+    def dirty_ranges(self) -> list[tuple[int, int]]:
+        """Returns the coalesced (start, end) ranges that have been written."""
+        return list(self.dirty)
+
+    def wrap_status_update(
+        self, status_update: Callable[[str, float], None]
+    ) -> Callable[[str, float], None]:
+        """
+        Returns a status update function that also starts a new step for each message it
+        receives, then calls the provided function.
+        """
+
+        def update(message: str, progress: float) -> None:
+            self.step = message.rstrip(".")
+            status_update(message, progress)
+
+        return update
+
+    def copy(self) -> "WriteJournal":
+        other = WriteJournal()
+        other.step = self.step
+        other.dirty = self.dirty.copy()
+        for name, step in self.steps.items():
+            other.steps[name] = StepWrites(step.write_count, step.bytes_written, step.ranges.copy())
+        return other
@@ -1,6 +1,6 @@
 from collections import defaultdict
 
-from mars_patcher.compress import comp_lz77, decomp_lz77
+from mars_patcher.compress import comp_lz77_to_fit
 from mars_patcher.constants.game_data import (
     anim_graphics_count,
     anim_tileset_count,
@@ -10,14 +10,13 @@ from mars_patcher.constants.game_data import (
     tileset_count,
     tileset_entries,
 )
-from mars_patcher.convert_array import ptr_to_u8
 from mars_patcher.item_messages import ItemMessages, ItemMessagesKind
 from mars_patcher.palette import PAL_ROW_SIZE
-from mars_patcher.rom import Rom
+from mars_patcher.rom import ROM_OFFSET, Rom
 from mars_patcher.room_entry import RoomEntry
 from mars_patcher.text import Language, MessageType, encode_text
 from mars_patcher.tilemap import Tilemap, TilemapType
-from mars_patcher.tileset import ANIM_TILESET_SIZE, TILESET_SIZE, Tileset
+from mars_patcher.tileset import ANIM_TILESET_SIZE, TILESET_ENTRY, TILESET_SIZE, Tileset
 from mars_patcher.zm.auto_generated_types import MarsschemazmTankIncrements
 from mars_patcher.zm.constants.game_data import (
     chozo_statue_targets_addr,
@@ -360,18 +359,14 @@ class ItemPatcher:
     ) -> bytes:
         """Creates a copy of a tileset entry using the provided palette address, tilemap address,
         and animated tileset ID."""
-        tileset = Tileset(self.rom, id)
-        data = bytearray()
-        data += self.rom.read_bytes(tileset.block_bg_gfx_ptr(), 4)
-        data += ptr_to_u8(pal_addr)
-        data += self.rom.read_bytes(tileset.tiled_bg_gfx_ptr(), 4)
-        data += ptr_to_u8(tilemap_addr)
-        data.append(anim_tileset_id)
-        data.append(tileset.anim_palette())
-        # Padding
-        data.append(0)
-        data.append(0)
-        return bytes(data)
+        entry = Tileset(self.rom, id).read()
+        entry = entry._replace(
+            palette_ptr=pal_addr + ROM_OFFSET,
+            tilemap_ptr=tilemap_addr + ROM_OFFSET,
+            anim_tileset=anim_tileset_id,
+            padding=bytes(2),
+        )
+        return TILESET_ENTRY.pack(entry)
 
     def write_new_tilesets(
         self, new_tileset_entries: list[bytes], new_anim_tileset_entries: list[bytes]
@@ -476,7 +471,7 @@ class ItemPatcher:
     ) -> None:
         assert len(item_gfx) == 12 * 32, "Item graphics should be 12 tiles"
         gfx_addr = self.rom.read_ptr(gfx_ptrs[0])
-        gfx_data, orig_size = decomp_lz77(self.rom.data, gfx_addr)
+        gfx_data, orig_size = self.rom.read_lz77(gfx_addr)
 
         offset = (tile_y * 32 + tile_x) * 32
         src = 0
@@ -486,7 +481,8 @@ class ItemPatcher:
                 gfx_data[dst : dst + 64] = item_gfx[src : src + 64]
                 src += 64
 
-        comp_data = comp_lz77(gfx_data)
+        # Try to fit the graphics in their original location, so they don't need to be repointed
+        comp_data = comp_lz77_to_fit(gfx_data, orig_size, self.rom.compression_cache)
         self.rom.write_repointable_data(gfx_addr, orig_size, comp_data, gfx_ptrs)
 
     def replace_sprite_palette(self, pal_addr: int, item_pal: bytes, row: int) -> None:
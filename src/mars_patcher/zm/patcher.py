@@ -1,14 +1,15 @@
 from collections.abc import Callable
 from os import PathLike
+from typing import BinaryIO
 
+from mars_patcher.data_tables import data_table_ranges
 from mars_patcher.random_palettes import PaletteRandomizer, PaletteSettings
-from mars_patcher.rom import Rom
+from mars_patcher.rom import OutputFormat, Rom
 from mars_patcher.room_names import write_room_names
 from mars_patcher.sounds import set_sounds
 from mars_patcher.text import write_seed_hash
 from mars_patcher.title_screen_text import write_title_text
 from mars_patcher.zm.auto_generated_types import MarsSchemaZM
-from mars_patcher.zm.constants.reserved_space import ReservedConstantsZM
 from mars_patcher.zm.credits import write_credits
 from mars_patcher.zm.hint_text import write_hint_text, write_intro_text
 from mars_patcher.zm.item_patcher import ItemPatcher, set_tank_increments
@@ -27,9 +28,13 @@ from mars_patcher.zm.starting import set_starting_items, set_starting_location
 
 def patch_zm(
     rom: Rom,
-    output_path: str | PathLike[str],
+    output_path: str | PathLike[str] | BinaryIO,
     patch_data: MarsSchemaZM,
     status_update: Callable[[str, float], None],
+    output_format: OutputFormat = OutputFormat.ROM,
+    discover_free_space: bool = False,
+    expand_size: int | None = None,
+    compact_free_space: bool = False,
 ) -> None:
     """
     Creates a new randomized Zero Mission game, based off of an input path, an output path,
@@ -37,16 +42,34 @@ def patch_zm(
 
     Args:
         input_path: The path to an unmodified Metroid Zero Mission (U) ROM.
-        output_path: The path where the randomized Zero Mission ROM should be saved to.
+        output_path: The path or binary file object where the randomized Zero Mission ROM should be
+            saved to.
         patch_data: A dictionary defining how the game should be randomized.
             This function assumes that it satisfies the needed schema. To validate it, use
             validate_patch_data_zm().
         status_update: A function taking in a message (str) and a progress value (float).
+            A summary of the free space usage is also sent to it before saving.
+        output_format: Whether to save the full ROM or a patch against the original ROM.
+        discover_free_space: Whether unused padding in the ROM should be added to the free
+            space, in addition to the reserved free space.
+        expand_size: If provided, the ROM is expanded to this size (16 MB or 32 MB), and the
+            new space is used for data that doesn't fit in the reserved free space.
+        compact_free_space: Whether data written to free space should be packed together at
+            the end of patching, leaving one large free block.
     """
+    # Tag journaled writes with the step that made them
+    send_report = status_update
+    if rom.journal is not None:
+        status_update = rom.journal.wrap_status_update(status_update)
 
     # Apply base patch first
     # apply_base_patch(rom)
 
+    if discover_free_space:
+        rom.discover_free_space(exclude=data_table_ranges(rom))
+    if expand_size is not None:
+        rom.expand(expand_size)
+
     # Randomize palettes - palettes are randomized first since the item
     # patcher needs to copy tilesets
     if "palettes" in patch_data:
@@ -110,6 +133,7 @@ def patch_zm(
         write_credits(rom, credits_text)
 
     # Misc patches
+    rom.set_journal_step("Applying misc patches")
     if patch_data.get("skip_door_transitions"):
         skip_door_transitions(rom)
 
@@ -152,6 +176,7 @@ def patch_zm(
     #     status_update("Writing door locks...", -1)
     #     set_door_locks(rom, door_locks)
 
+    rom.set_journal_step("Writing seed hash")
     write_seed_hash(rom, patch_data["seed_hash"])
 
     # Title screen text
@@ -159,12 +184,15 @@ def patch_zm(
         status_update("Writing title screen text...", -1)
         write_title_text(rom, title_screen_text)
 
-    free_space_size = (
-        ReservedConstantsZM.PATCHER_FREE_SPACE_END - ReservedConstantsZM.PATCHER_FREE_SPACE_ADDR
-    )
-    free_space_used = rom.free_space_addr - ReservedConstantsZM.PATCHER_FREE_SPACE_ADDR
-    percent = free_space_used / free_space_size
-    print(f"Free space used: {free_space_used:X}/{free_space_size:X} ({percent:.2%})")
+    if compact_free_space:
+        status_update("Compacting free space...", -1)
+        rom.compact_free_space()
+
+    # Sent without starting a new journal step, since it's not a patching step
+    send_report(rom.space_report(), -1)
 
-    rom.save(output_path)
-    status_update(f"Output written to {output_path}", -1)
+    rom.save(output_path, output_format)
+    if isinstance(output_path, (str, PathLike)):
+        status_update(f"Output written to {output_path}", -1)
+    else:
+        status_update("Output written", -1)
@@ -0,0 +1,14 @@
+import pytest
+
+from mars_patcher.rom import SIZE_8MB, Rom
+
+TITLE_ADDR = 0xA0
+TITLE_MF_U = b"METROID4USA\0AMTE"
+
+
+@pytest.fixture
+def blank_rom() -> Rom:
+    """An empty MF (U) ROM with only the title set."""
+    data = bytearray(SIZE_8MB)
+    data[TITLE_ADDR : TITLE_ADDR + len(TITLE_MF_U)] = TITLE_MF_U
+    return Rom.from_buffer(data)
@@ -0,0 +1,48 @@
+from mars_patcher.asset_cache import AssetCache
+
+
+def _local_cache() -> AssetCache:
+    """Returns a cache with local entries at 0x100-0x140, 0x200-0x210, and 0x300-0x380."""
+    cache = AssetCache()
+    cache.invalidate(0, 0x1000)
+    cache.put("lz77", 0x100, b"a", 0x40)
+    cache.put("rle", 0x200, b"b", 0x10)
+    cache.put("lz77", 0x300, b"c", 0x80)
+    return cache
+
+
+def test_write_only_invalidates_overlapping_local_entries() -> None:
+    cache = _local_cache()
+    # Touches the end of the first entry, and ends right before the second
+    cache.invalidate(0x13F, 0xC1)
+    assert cache.get("lz77", 0x100) is None
+    assert cache.get("rle", 0x200) == (bytearray(b"b"), 0x10)
+    assert cache.get("lz77", 0x300) == (bytearray(b"c"), 0x80)
+    # Inside the last entry, which is larger than the ones before it
+    cache.invalidate(0x37F, 1)
+    assert cache.get("lz77", 0x300) is None
+    assert cache.get("rle", 0x200) == (bytearray(b"b"), 0x10)
+
+
+def test_entries_of_each_kind_at_an_address() -> None:
+    cache = _local_cache()
+    cache.put("rle", 0x100, b"d", 0x8)
+    # Only overlaps the larger entry
+    cache.invalidate(0x120, 1)
+    assert cache.get("lz77", 0x100) is None
+    assert cache.get("rle", 0x100) == (bytearray(b"d"), 0x8)
+    cache.invalidate(0x100, 1)
+    assert cache.get("rle", 0x100) is None
+    # Entries can be added again at the same address
+    cache.put("rle", 0x100, b"e", 0x8)
+    assert cache.get("rle", 0x100) == (bytearray(b"e"), 0x8)
+
+
+def test_fork_has_its_own_local_entries() -> None:
+    cache = _local_cache()
+    fork = cache.fork()
+    fork.invalidate(0x200, 1)
+    fork.put("rle", 0x280, b"f", 0x10)
+    assert fork.get("rle", 0x200) is None
+    assert cache.get("rle", 0x200) == (bytearray(b"b"), 0x10)
+    assert cache.get("rle", 0x280) is None
@@ -0,0 +1,47 @@
+import pytest
+
+from mars_patcher.rom import ROM_OFFSET, Rom
+
+# Pointer locations in a part of the ROM that is otherwise unused
+FIRST_PTR = 0x1000
+BLOCK_PTR = 0x1004
+SHARED_PTR = 0x1008
+
+BLOCK_DATA = bytes(range(1, 0x11))
+
+
+@pytest.fixture
+def rom(blank_rom: Rom) -> Rom:
+    rom = blank_rom
+    # Leave a gap at the start of the free space by repointing the first block
+    first = rom.write_data_with_pointers(b"\xaa" * 0x20, [FIRST_PTR])
+    rom.write_data_with_pointers(BLOCK_DATA, [BLOCK_PTR])
+    rom.write_repointable_data(first, 0x20, b"\xaa" * 0x40, [FIRST_PTR])
+    return rom
+
+
+def test_moves_block_with_recorded_pointers(rom: Rom) -> None:
+    rom.compact_free_space()
+    assert rom.read_ptr(BLOCK_PTR) == rom.free_space_start
+    assert rom.read_bytes(rom.free_space_start, len(BLOCK_DATA)) == BLOCK_DATA
+
+
+def test_keeps_block_shared_by_several_pointers(rom: Rom) -> None:
+    block = rom.read_ptr(BLOCK_PTR)
+    # Share the block with a pointer that isn't recorded in its allocation
+    rom.write_ptr(SHARED_PTR, block)
+
+    rom.compact_free_space()
+    assert rom.read_ptr(BLOCK_PTR) == block
+    assert rom.read_ptr(SHARED_PTR) == block
+    assert rom.read_bytes(block, len(BLOCK_DATA)) == BLOCK_DATA
+
+
+def test_keeps_block_pointed_to_from_written_data(rom: Rom) -> None:
+    block = rom.read_ptr(BLOCK_PTR)
+    # A pointer written as part of other data, instead of with write_ptr
+    rom.write_bytes(SHARED_PTR, (block + ROM_OFFSET).to_bytes(4, "little"))
+
+    rom.compact_free_space()
+    assert rom.read_ptr(BLOCK_PTR) == block
+    assert rom.read_ptr(SHARED_PTR) == block
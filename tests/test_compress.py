@@ -0,0 +1,83 @@
+import random
+from pathlib import Path
+
+import pytest
+
+from mars_patcher.compress import (
+    LZ77_VERSION,
+    RLE_VERSION,
+    comp_lz77,
+    comp_rle,
+    decomp_lz77,
+    decomp_rle,
+)
+from mars_patcher.compression_cache import CompressionCache
+
+
+def _samples() -> list[bytes]:
+    rng = random.Random(1)
+    return [
+        b"",
+        b"\x00",
+        b"\x12\x34" * 0x800,
+        bytes(range(256)) * 8,
+        rng.randbytes(0x400),
+        # Tile-like data: mostly runs with some noise
+        b"".join(bytes([rng.randrange(4)]) * rng.randrange(1, 40) for _ in range(200)),
+    ]
+
+
+@pytest.mark.parametrize("data", _samples())
+def test_rle_round_trip(data: bytes) -> None:
+    # RLE works on 16-bit values
+    if len(data) % 2:
+        data += b"\x00"
+    comp = comp_rle(data)
+    output, comp_size = decomp_rle(comp, 0)
+    assert output == data
+    assert comp_size == len(comp)
+
+
+@pytest.mark.parametrize("data", [d for d in _samples() if d])
+@pytest.mark.parametrize(
+    "kwargs",
+    [{}, {"max_checks_in_window": 512, "lazy": True}, {"optimal": True}],
+)
+def test_lz77_round_trip(data: bytes, kwargs: dict) -> None:
+    comp = comp_lz77(data, **kwargs)
+    output, comp_size = decomp_lz77(comp, 0)
+    assert output == data
+    assert comp_size == len(comp)
+
+
+def test_lz77_optimal_is_not_larger() -> None:
+    for data in _samples()[1:]:
+        assert len(comp_lz77(data, optimal=True)) <= len(comp_lz77(data))
+
+
+def test_cache_reuses_output(tmp_path: Path) -> None:
+    cache = CompressionCache(tmp_path)
+    data = bytes(range(256)) * 8
+    comp = comp_lz77(data, cache=cache)
+    key = cache.key(f"lz77-{LZ77_VERSION}-64-0", data)
+    assert cache.get(key) == comp
+    assert comp_lz77(data, cache=cache) == comp
+
+
+@pytest.mark.parametrize("damage", ["truncate", "corrupt"])
+def test_cache_ignores_damaged_entries(tmp_path: Path, damage: str) -> None:
+    cache = CompressionCache(tmp_path)
+    data = b"\x12\x34" * 0x800
+    comp = comp_rle(data, cache)
+    key = cache.key(f"rle-{RLE_VERSION}", data)
+    path = tmp_path / (key + ".bin")
+    entry = bytearray(path.read_bytes())
+    if damage == "truncate":
+        del entry[-1]
+    else:
+        entry[-1] ^= 0xFF
+    path.write_bytes(entry)
+    assert cache.get(key) is None
+    # The damaged entry is replaced
+    assert comp_rle(data, cache) == comp
+    assert cache.get(key) == comp
@@ -0,0 +1,51 @@
+import pytest
+
+from mars_patcher.rom import Rom
+
+# Pointer locations in a part of the ROM that is otherwise unused
+FIRST_PTR = 0x1000
+SECOND_PTR = 0x1004
+
+DATA = bytes(range(1, 0x21))
+
+
+@pytest.fixture
+def rom(blank_rom: Rom) -> Rom:
+    blank_rom.enable_deduplication()
+    return blank_rom
+
+
+def test_identical_data_is_shared(rom: Rom) -> None:
+    first = rom.write_data_with_pointers(DATA, [FIRST_PTR])
+    second = rom.write_data_with_pointers(DATA, [SECOND_PTR])
+    assert first == second
+    assert rom.read_ptr(SECOND_PTR) == first
+
+
+def test_different_data_is_not_shared(rom: Rom) -> None:
+    first = rom.write_data_with_pointers(DATA, [FIRST_PTR])
+    second = rom.write_data_with_pointers(DATA[::-1], [SECOND_PTR])
+    assert first != second
+    assert rom.read_bytes(first, len(DATA)) == DATA
+    assert rom.read_bytes(second, len(DATA)) == DATA[::-1]
+
+
+def test_repointing_shared_data_writes_a_copy(rom: Rom) -> None:
+    shared = rom.write_data_with_pointers(DATA, [FIRST_PTR])
+    rom.write_data_with_pointers(DATA, [SECOND_PTR])
+
+    new_data = b"\xee" * len(DATA)
+    addr = rom.write_repointable_data(shared, len(DATA), new_data, [SECOND_PTR])
+    assert addr != shared
+    assert rom.read_bytes(shared, len(DATA)) == DATA
+    assert rom.read_bytes(addr, len(DATA)) == new_data
+    assert rom.read_ptr(FIRST_PTR) == shared
+    assert rom.read_ptr(SECOND_PTR) == addr
+
+
+def test_overwritten_data_is_not_reused(rom: Rom) -> None:
+    first = rom.write_data_with_pointers(DATA, [FIRST_PTR])
+    rom.write_bytes(first, b"\0" * len(DATA))
+    second = rom.write_data_with_pointers(DATA, [SECOND_PTR])
+    assert second != first
+    assert rom.read_bytes(second, len(DATA)) == DATA
@@ -0,0 +1,71 @@
+import random
+from zlib import crc32
+
+import pytest
+
+from mars_patcher.patching import BpsDecoder, BpsEncoder, IpsDecoder, IpsEncoder
+
+SOURCE_SIZE = 0x10000
+
+
+@pytest.fixture
+def source() -> bytes:
+    return random.Random(1).randbytes(SOURCE_SIZE)
+
+
+@pytest.fixture
+def target(source: bytes) -> bytearray:
+    target = bytearray(source)
+    # Scattered changes, a long run of one byte, and a change at the very end
+    rng = random.Random(2)
+    for _ in range(50):
+        target[rng.randrange(SOURCE_SIZE)] ^= 0xFF
+    target[0x4000:0x6000] = b"\xff" * 0x2000
+    target[-1] ^= 0xFF
+    return target
+
+
+def test_bps_round_trip(source: bytes, target: bytearray) -> None:
+    patch = BpsEncoder().create_patch(source, target)
+    assert BpsDecoder().apply_patch(patch, source) == target
+
+
+def test_bps_round_trip_with_dirty_ranges(source: bytes, target: bytearray) -> None:
+    dirty = [(0, SOURCE_SIZE)]
+    patch = BpsEncoder().create_patch(source, target, dirty)
+    assert patch == BpsEncoder().create_patch(source, target)
+
+
+def test_bps_round_trip_larger_target(source: bytes) -> None:
+    target = source + b"\xff" * 0x1000 + b"end"
+    patch = BpsEncoder().create_patch(source, target)
+    assert BpsDecoder().apply_patch(patch, source) == target
+
+
+def test_bps_rejects_wrong_source(source: bytes, target: bytearray) -> None:
+    patch = BpsEncoder().create_patch(source, target)
+    with pytest.raises(ValueError):
+        BpsDecoder().apply_patch(patch, bytes(SOURCE_SIZE))
+
+
+def test_ips_round_trip(source: bytes, target: bytearray) -> None:
+    patch = IpsEncoder().create_patch(source, target)
+    data = bytearray(source)
+    IpsDecoder().apply_patch(patch, data)
+    assert data == target
+
+
+def test_ips_rejects_size_change(source: bytes) -> None:
+    with pytest.raises(ValueError):
+        IpsEncoder().create_patch(source, source + b"\0")
+
+
+def test_bps_checks_target_with_known_source_checksum(source: bytes, target: bytearray) -> None:
+    patch = BpsEncoder().create_patch(source, target)
+    checksum = crc32(source)
+    assert BpsDecoder().apply_patch(patch, source, source_checksum=checksum) == target
+    # A wrong source with the checksum of the right one is caught by the target checksum
+    wrong_source = bytearray(source)
+    wrong_source[0] ^= 0xFF
+    with pytest.raises(ValueError):
+        BpsDecoder().apply_patch(patch, wrong_source, source_checksum=checksum)
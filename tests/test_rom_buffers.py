@@ -0,0 +1,34 @@
+from pathlib import Path
+
+import pytest
+
+from mars_patcher.rom import Rom
+
+
+def test_from_buffer_reads_see_writes(blank_rom: Rom) -> None:
+    rom = Rom.from_buffer(bytes(blank_rom.data))
+    assert rom.read_32(0x1000) == 0
+    rom.write_32(0x1000, 0x12345678)
+    assert rom.read_32(0x1000) == 0x12345678
+    assert rom.read_u32_array(0x1000, 1) == [0x12345678]
+    # The buffer the ROM was created from is never modified
+    assert blank_rom.read_32(0x1000) == 0
+
+
+def test_from_mmap_closes_file(blank_rom: Rom, tmp_path: Path) -> None:
+    path = tmp_path / "rom.gba"
+    path.write_bytes(blank_rom.data)
+    with Rom.from_mmap(path) as rom:
+        rom.write_8(0x1000, 1)
+        assert rom.read_8(0x1000) == 1
+    # Pages that weren't copied were read from the file
+    with pytest.raises(ValueError):
+        rom.read_8(0x2000)
+
+
+def test_from_mmap_closes_file_of_invalid_rom(tmp_path: Path) -> None:
+    path = tmp_path / "rom.gba"
+    path.write_bytes(bytes(0x800000))
+    # The file is closed before the error is raised
+    with pytest.raises(ValueError):
+        Rom.from_mmap(path)
@@ -0,0 +1,86 @@
+from pathlib import Path
+
+import pytest
+
+import mars_patcher.mf.misc_patches as misc_patches
+from mars_patcher.patching import IpsEncoder
+from mars_patcher.rom import SIZE_8MB, SIZE_16MB, Rom
+
+ADDR = 0x1000
+PTR = 0x2000
+DATA = bytes(range(1, 0x21))
+
+
+def test_rollback_undoes_writes(blank_rom: Rom) -> None:
+    before = bytes(blank_rom.data)
+    with blank_rom.transaction() as txn:
+        blank_rom.write_32(ADDR, 0x12345678)
+        blank_rom.write_bytes(ADDR + 2, b"\xff" * 0x10)
+        txn.rollback()
+    assert blank_rom.data == before
+
+
+def test_exception_rolls_back_free_space(blank_rom: Rom) -> None:
+    stats = blank_rom.allocator.stats()
+    with pytest.raises(RuntimeError), blank_rom.transaction():
+        blank_rom.write_data_with_pointers(DATA, [PTR])
+        raise RuntimeError
+    assert blank_rom.read_32(PTR) == 0
+    assert blank_rom.allocator.stats() == stats
+    assert blank_rom.allocations == {}
+
+
+def test_rollback_undoes_expand(blank_rom: Rom) -> None:
+    before = bytes(blank_rom.data)
+    # A view of the data would keep a bytearray from being resized in place
+    view = memoryview(blank_rom.data)
+    with blank_rom.transaction() as txn:
+        blank_rom.write_8(ADDR, 1)
+        blank_rom.expand(SIZE_16MB)
+        blank_rom.write_8(SIZE_8MB, 2)
+        txn.rollback()
+    view.release()
+    assert len(blank_rom.data) == SIZE_8MB
+    assert blank_rom.data == before
+    assert blank_rom.allocator.free_size_in(SIZE_8MB, SIZE_16MB) == 0
+
+
+def test_rollback_undoes_ips_patch(
+    blank_rom: Rom, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    before = bytes(blank_rom.data)
+    target = bytearray(before)
+    target[ADDR : ADDR + len(DATA)] = DATA
+    path = tmp_path / "test.ips"
+    path.write_bytes(IpsEncoder().create_patch(before, target))
+    monkeypatch.setattr(misc_patches, "_get_patch_path", lambda *args: str(path))
+
+    with blank_rom.transaction() as txn:
+        misc_patches.apply_patch_in_data_path(blank_rom, "test.ips")
+        assert blank_rom.data == target
+        txn.rollback()
+    assert blank_rom.data == before
+
+
+def test_outer_rollback_undoes_inner_changes(blank_rom: Rom) -> None:
+    before = bytes(blank_rom.data)
+    with blank_rom.transaction() as outer:
+        blank_rom.write_8(ADDR, 1)
+        with blank_rom.transaction():
+            blank_rom.write_data_with_pointers(DATA, [PTR])
+            blank_rom.expand(SIZE_16MB)
+        outer.rollback()
+    assert blank_rom.data == before
+    assert blank_rom.allocations == {}
+
+
+def test_inner_rollback_keeps_outer_changes(blank_rom: Rom) -> None:
+    with blank_rom.transaction():
+        blank_rom.write_8(ADDR, 1)
+        with pytest.raises(RuntimeError), blank_rom.transaction():
+            blank_rom.write_8(ADDR + 1, 2)
+            blank_rom.expand(SIZE_16MB)
+            raise RuntimeError
+    assert len(blank_rom.data) == SIZE_8MB
+    assert blank_rom.read_8(ADDR) == 1
+    assert blank_rom.read_8(ADDR + 1) == 0